@@ -0,0 +1,154 @@
+#
+# Django Gems.
+#
+# Copyright (C) 2016 Pier Luigi Fiorini
+#
+# Author: Pier Luigi Fiorini <pierluigi.fiorini@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#	1. Redistributions of source code must retain the above copyright notice,
+#	   this list of conditions and the following disclaimer.
+#
+#	2. Redistributions in binary form must reproduce the above copyright
+#	   notice, this list of conditions and the following disclaimer in the
+#	   documentation and/or other materials provided with the distribution.
+#
+#	3. Neither the name of the project nor the names of its contributors may
+#	   be used to endorse or promote products derived from this software
+#	   without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+"""
+Conformance and speed of the JSON backends of django_gems.json that are
+installed: every encoder must produce the same bytes as the json one for
+Django types and every decoder the same data, types included; then grid
+and model payloads are encoded and decoded with each of them.
+"""
+
+import os, sys, datetime, timeit
+from decimal import Decimal
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+from django.utils.functional import lazy
+from django.utils.safestring import mark_safe
+from django.utils.timezone import utc
+from django_gems import json as gems_json
+from benchmarks.models import Item
+
+def get_backends():
+	backends = {}
+	for name, factory in sorted(gems_json.JSON_BACKEND_FACTORIES.items()):
+		try:
+			backends[name] = factory()
+		except ImportError:
+			print("%s: not installed" % name)
+	return backends
+
+def make_items(rows):
+	items = []
+	for i in range(rows):
+		item = Item(id=i, name=u"item \xe8 %d" % i, description="description %d" % i,
+			price=Decimal("%d.%02d" % (i, i % 100)), quantity=i % 50, active=i % 2 == 0,
+			created=datetime.date(2015, 1, 1) + datetime.timedelta(days=i % 365),
+			category_id=1)
+		item.total = item.price * item.quantity
+		items.append(item)
+	return items
+
+def make_rows(rows):
+	# What JqGrid.get_json() encodes: a page of values() dicts
+	return {
+		"page": 1,
+		"total": 1,
+		"records": rows,
+		"rows": [{
+			"id": i,
+			"name": u"item \xe8 %d" % i,
+			"price": Decimal("%d.%02d" % (i, i % 100)),
+			"quantity": i % 50,
+			"active": i % 2 == 0,
+			"created": datetime.date(2015, 1, 1) + datetime.timedelta(days=i % 365),
+			"category__name": None,
+		} for i in range(rows)],
+	}
+
+CONFORMANCE = {
+	"decimal": [Decimal("1.50"), Decimal("-0.001"), Decimal("1E+3")],
+	"datetime": [datetime.datetime(2015, 1, 2, 3, 4, 5), datetime.datetime(2015, 1, 2, 3, 4, 5, 6789),
+		datetime.datetime(2015, 1, 2, 3, 4, 5, tzinfo=utc)],
+	"date": datetime.date(2015, 1, 2),
+	"time": [datetime.time(3, 4, 5), datetime.time(3, 4, 5, 6789)],
+	"promise": lazy(lambda: u"lazy \xe8", unicode)(),
+	"safe": mark_safe(u"<b>safe</b>"),
+	"strings": ["ascii", u"unicode \xe8 \u20ac", u"quotes \" \\ \n"],
+	"numbers": [0, -1, 2 ** 70, 0.1, 1e100, True, False, None],
+	"nested": {1: [(1, Decimal("2")), {"date": datetime.date(2015, 1, 2)}]},
+	"models": make_items(3),
+}
+
+def same(a, b):
+	"""
+	Tell if a and b are equal and of the same types all the way down, so
+	that str is not taken for unicode.
+	"""
+	if type(a) is not type(b):
+		return False
+	if isinstance(a, dict):
+		keys = sorted(a)
+		return same(keys, sorted(b)) and all(same(a[k], b[k]) for k in keys)
+	if isinstance(a, (list, tuple)):
+		return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+	return a == b
+
+def check(backends):
+	"""
+	Return the names of the backends that don't conform to json.
+	"""
+	reference_dumps, reference_loads = backends["json"]
+	reference = reference_dumps(CONFORMANCE)
+	failed = []
+	for name, (dumps, loads) in sorted(backends.items()):
+		try:
+			if dumps is not None and dumps(CONFORMANCE) != reference:
+				raise ValueError("encoding differs from json")
+			if loads is not None and not same(loads(reference), reference_loads(reference)):
+				raise ValueError("decoding differs from json")
+		except (TypeError, ValueError, OverflowError) as e:
+			failed.append(name)
+			print("%s: %s" % (name, e))
+		else:
+			print("%s: conforms" % name)
+	return failed
+
+def main(rows=10000, number=3):
+	backends = get_backends()
+	failed = check(backends)
+	payloads = (("grid", make_rows(rows)), ("models", make_items(rows)))
+	for payload_name, payload in payloads:
+		encoded = backends["json"][0](payload)
+		for name, (dumps, loads) in sorted(backends.items()):
+			for operation, func, data in (("encode", dumps, payload), ("decode", loads, encoded)):
+				if func is None:
+					continue
+				elapsed = min(timeit.repeat(lambda: func(data), number=number, repeat=3))
+				print("%s %s %s: %.1f ms" % (payload_name, name, operation,
+					elapsed / number * 1000))
+	return failed
+
+if __name__ == "__main__":
+	sys.exit(main() and 1 or 0)
@@ -0,0 +1,82 @@
+#
+# Django Gems.
+#
+# Copyright (C) 2016 Pier Luigi Fiorini
+#
+# Author: Pier Luigi Fiorini <pierluigi.fiorini@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#	1. Redistributions of source code must retain the above copyright notice,
+#	   this list of conditions and the following disclaimer.
+#
+#	2. Redistributions in binary form must reproduce the above copyright
+#	   notice, this list of conditions and the following disclaimer in the
+#	   documentation and/or other materials provided with the distribution.
+#
+#	3. Neither the name of the project nor the names of its contributors may
+#	   be used to endorse or promote products derived from this software
+#	   without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+"""
+Time spent by JqGrid.get_config() for every grid rendered in a page, with
+the configuration cache cold (what every render used to pay) and warm.
+"""
+
+import os, timeit
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+from django.template import Context, Template
+from django_gems import jqgrid
+from benchmarks.models import Item
+
+class ItemGrid(jqgrid.JqGrid):
+	model = Item
+	url = "/items/"
+	fields = ["id", "name", "description", "price", "quantity", "active",
+		"created", "category__name"]
+	colmodel_overrides = {"price": {"align": "right"}}
+
+PAGE = Template("""{% for grid in grids %}
+<script>$("#grid{{ forloop.counter }}").jqGrid({{ grid.get_config|safe }});</script>
+{% endfor %}""")
+
+class NoCache(dict):
+	"""Configuration cache that never keeps anything."""
+	def __setitem__(self, key, value):
+		pass
+
+def main(number=2000, grids=5):
+	def config_json():
+		ItemGrid().get_config()
+
+	def config_dict():
+		ItemGrid().get_config(as_json=False)
+
+	def render():
+		PAGE.render(Context({"grids": [ItemGrid() for i in range(grids)]}))
+
+	for name, func in (("json", config_json), ("dict", config_dict),
+			("page of %d grids" % grids, render)):
+		for state, configs in (("cold", NoCache()), ("warm", {})):
+			jqgrid._configs = configs
+			elapsed = min(timeit.repeat(func, number=number, repeat=3))
+			print("%s %s: %.1f us per render" % (name, state, elapsed / number * 1e6))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,93 @@
+#
+# Django Gems.
+#
+# Copyright (C) 2016 Pier Luigi Fiorini
+#
+# Author: Pier Luigi Fiorini <pierluigi.fiorini@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#	1. Redistributions of source code must retain the above copyright notice,
+#	   this list of conditions and the following disclaimer.
+#
+#	2. Redistributions in binary form must reproduce the above copyright
+#	   notice, this list of conditions and the following disclaimer in the
+#	   documentation and/or other materials provided with the distribution.
+#
+#	3. Neither the name of the project nor the names of its contributors may
+#	   be used to endorse or promote products derived from this software
+#	   without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+"""
+Synthetic dataset for the benchmarks, built with plain SQL because the
+ORM is too slow for millions of rows.
+"""
+
+import datetime, random
+
+from django.core.management import call_command
+from django.db import connection
+try:
+	from django.db.transaction import atomic
+except ImportError:
+	from django.db.transaction import commit_on_success as atomic
+
+from benchmarks.models import Category, Item
+
+WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf",
+	"hotel", "india", "juliet", "kilo", "lima", "mike", "november")
+
+CATEGORIES = 100
+
+def create_tables():
+	call_command("syncdb", interactive=False, verbosity=0)
+
+def build(rows, seed=0, batch_size=10000):
+	"""
+	Fill the tables with rows items, an existing dataset of the same size
+	is kept.
+	"""
+	create_tables()
+	if Item.objects.count() == rows:
+		return
+	cursor = connection.cursor()
+	with atomic():
+		cursor.execute("DELETE FROM %s" % Item._meta.db_table)
+		cursor.execute("DELETE FROM %s" % Category._meta.db_table)
+		cursor.executemany("INSERT INTO %s (id, name) VALUES (%%s, %%s)" % Category._meta.db_table,
+			[(i, "category %d" % i) for i in range(1, CATEGORIES + 1)])
+
+	rnd = random.Random(seed)
+	start = datetime.date(2000, 1, 1)
+	sql = "INSERT INTO %s (id, name, description, price, quantity, active, created, category_id, " \
+		"rating) VALUES (%%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s)" % Item._meta.db_table
+	for offset in range(0, rows, batch_size):
+		batch = []
+		for i in range(offset + 1, min(offset + batch_size, rows) + 1):
+			batch.append((i,
+				"%s %07d" % (rnd.choice(WORDS), i),
+				" ".join([rnd.choice(WORDS) for w in range(rnd.randint(5, 30))]),
+				"%d.%02d" % (rnd.randint(0, 9999), rnd.randint(0, 99)),
+				rnd.randint(0, 999),
+				rnd.random() < 0.5,
+				start + datetime.timedelta(days=rnd.randint(0, 7000)),
+				rnd.randint(1, CATEGORIES),
+				# One item out of ten is not rated
+				rnd.random() < 0.9 and rnd.randint(1, 5) or None))
+		with atomic():
+			cursor.executemany(sql, batch)
@@ -0,0 +1,102 @@
+#
+# Django Gems.
+#
+# Copyright (C) 2016 Pier Luigi Fiorini
+#
+# Author: Pier Luigi Fiorini <pierluigi.fiorini@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#	1. Redistributions of source code must retain the above copyright notice,
+#	   this list of conditions and the following disclaimer.
+#
+#	2. Redistributions in binary form must reproduce the above copyright
+#	   notice, this list of conditions and the following disclaimer in the
+#	   documentation and/or other materials provided with the distribution.
+#
+#	3. Neither the name of the project nor the names of its contributors may
+#	   be used to endorse or promote products derived from this software
+#	   without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+"""
+Time spent by json_encode() on model instances, with the per class
+serialization plans cold (what every instance used to pay) and warm,
+then size and time of an interlinked graph encoded inline, with refs and
+with max_depth.
+"""
+
+import os, datetime, timeit
+from decimal import Decimal
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+from django_gems import json as gems_json
+from benchmarks.models import Category, Item
+
+class NoCache(dict):
+	"""Plan cache that never keeps anything."""
+	def __setitem__(self, key, value):
+		pass
+
+def make_item(i, category_id=1):
+	return Item(id=i, name="item %d" % i, description="description %d" % i,
+		price=Decimal("%d.%02d" % (i, i % 100)), quantity=i % 50, active=i % 2 == 0,
+		created=datetime.date(2015, 1, 1) + datetime.timedelta(days=i % 365),
+		category_id=category_id)
+
+def make_graph(rows, categories=100, best_sellers=20):
+	"""
+	Items sharing categories, every category carries its best sellers.
+	"""
+	shared = []
+	for i in range(categories):
+		category = Category(id=i, name="category %d" % i)
+		category.best_sellers = [make_item(rows + i * best_sellers + j, i)
+			for j in range(best_sellers)]
+		shared.append(category)
+	items = []
+	for i in range(rows):
+		item = make_item(i, i % categories)
+		item.category_object = shared[i % categories]
+		items.append(item)
+	return items
+
+def main(rows=10000, number=3):
+	items = []
+	for i in range(rows):
+		item = make_item(i)
+		# A property added dynamically, encoded too
+		item.total = item.price * item.quantity
+		items.append(item)
+
+	for state, plans in (("cold", NoCache()), ("warm", {})):
+		gems_json._model_plans = plans
+		elapsed = min(timeit.repeat(lambda: gems_json.json_encode(items),
+			number=number, repeat=3))
+		print("%d instances %s: %.1f ms" % (rows, state, elapsed / number * 1000))
+
+	graph = make_graph(rows)
+	for name, kwargs in (("inline", {}), ("refs", {"refs": True}),
+			("max_depth=1", {"max_depth": 1})):
+		size = len(gems_json.json_encode(graph, **kwargs))
+		elapsed = min(timeit.repeat(lambda: gems_json.json_encode(graph, **kwargs),
+			number=number, repeat=3))
+		print("%d interlinked instances %s: %.1f ms, %d bytes" % (rows, name,
+			elapsed / number * 1000, size))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,242 @@
+#
+# Django Gems.
+#
+# Copyright (C) 2016 Pier Luigi Fiorini
+#
+# Author: Pier Luigi Fiorini <pierluigi.fiorini@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#	1. Redistributions of source code must retain the above copyright notice,
+#	   this list of conditions and the following disclaimer.
+#
+#	2. Redistributions in binary form must reproduce the above copyright
+#	   notice, this list of conditions and the following disclaimer in the
+#	   documentation and/or other materials provided with the distribution.
+#
+#	3. Neither the name of the project nor the names of its contributors may
+#	   be used to endorse or promote products derived from this software
+#	   without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+"""
+JqGrid benchmarks over a synthetic SQLite dataset.
+
+	python -m benchmarks.grid --rows 10000,1000000,5000000 --output results.json
+
+Every scenario runs get_json() --repeat times and reports latency
+percentiles in milliseconds, the number of queries per request and the
+peak resident memory. Scenarios run in a forked child process, so that
+peak_rss is the high-water mark of that scenario alone and base_rss the
+one of the process that built the dataset. The output is JSON so that runs on different
+commits can be compared.
+"""
+
+import os, sys, json, time, resource, subprocess
+from optparse import OptionParser
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+import django
+from django.db import reset_queries
+from django.test.client import RequestFactory
+
+from django_gems.jqgrid import JqGrid
+from django_gems.utils.db import QueryCounter
+from benchmarks import data
+from benchmarks.models import Item
+
+ROWS_PER_PAGE = 50
+
+class ItemGrid(JqGrid):
+	model = Item
+	fields = ["id", "name", "price", "quantity", "active", "created", "category__name"]
+
+class KeysetItemGrid(ItemGrid):
+	keyset = True
+
+class DistinctItemGrid(ItemGrid):
+	distinct = True
+
+class NoDistinctItemGrid(ItemGrid):
+	distinct = False
+
+# A search rule that makes sense for each jqGrid operator
+OPERATOR_RULES = {
+	"eq": ("quantity", "500"),
+	"ne": ("quantity", "500"),
+	"gt": ("quantity", "900"),
+	"ge": ("quantity", "900"),
+	"lt": ("quantity", "100"),
+	"le": ("quantity", "100"),
+	"in": ("quantity", "1,2,3"),
+	"ni": ("quantity", "1,2,3"),
+	"ieq": ("name", "ALPHA 0000001"),
+	"bw": ("name", "alpha"),
+	"bn": ("name", "alpha"),
+	"ew": ("name", "99"),
+	"en": ("name", "99"),
+	"cn": ("name", "lima"),
+	"nc": ("name", "lima"),
+	"icn": ("name", "LIMA"),
+	# icontains, the grid has no search backend
+	"fts": ("name", "lima"),
+}
+
+def percentile(values, percent):
+	values = sorted(values)
+	index = int(round(percent / 100.0 * (len(values) - 1)))
+	return values[index]
+
+def peak_rss():
+	# Kilobytes on Linux, bytes on Mac OS X
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def search(rules, group="AND"):
+	return {
+		"_search": "true",
+		"filters": json.dumps({"groupOp": group, "rules": [
+			{"op": op, "field": field, "data": value} for op, field, value in rules]}),
+	}
+
+def scenarios(rows):
+	"""
+	Yield (name, grid class, GET parameters) for every scenario.
+	"""
+	base = {"rows": ROWS_PER_PAGE, "sidx": "id", "sord": "asc"}
+	last = max((rows + ROWS_PER_PAGE - 1) // ROWS_PER_PAGE, 1)
+	pages = sorted(set([page for page in (1, 10, 100, 1000, 10000, last) if page <= last]))
+	for page in pages:
+		yield ("page/offset/%d" % page, ItemGrid, dict(base, page=page))
+	grid = KeysetItemGrid()
+	for page in pages:
+		params = dict(base, page=page)
+		if page > 1:
+			row = Item.objects.order_by("id").values("id")[(page - 1) * ROWS_PER_PAGE - 1]
+			params[grid.cursor_param] = grid.encode_cursor("next", ["id"], False, row)
+		yield ("page/keyset/%d" % page, KeysetItemGrid, params)
+	for op in sorted(JqGrid.filter_map):
+		field, value = OPERATOR_RULES[op]
+		yield ("filter/%s" % op, ItemGrid, dict(base, **search([(op, field, value)])))
+	rules = [("eq", "active", "true"), ("ge", "quantity", "500"), ("cn", "name", "lima")]
+	for group in ("AND", "OR"):
+		yield ("group/%s" % group.lower(), ItemGrid, dict(base, **search(rules, group)))
+	for kind, field in (("indexed", "quantity"), ("indexed", "created"),
+			("unindexed", "price"), ("unindexed", "name")):
+		for sord in ("asc", "desc"):
+			yield ("sort/%s/%s/%s" % (kind, field, sord), ItemGrid,
+				dict(base, sidx=field, sord=sord))
+	for name, grid_class in (("on", DistinctItemGrid), ("off", NoDistinctItemGrid)):
+		yield ("distinct/%s" % name, grid_class, base)
+		yield ("distinct/%s/search" % name, grid_class,
+			dict(base, **search([("eq", "category__name", "category 1")])))
+
+def measure(grid_class, params, repeat):
+	request = RequestFactory().get("/", params)
+	latencies, queries = [], []
+	for i in range(repeat):
+		reset_queries()
+		with QueryCounter() as counter:
+			start = time.time()
+			grid_class().get_json(request)
+			latencies.append((time.time() - start) * 1000)
+		queries.append(counter.count)
+	return {
+		"p50": percentile(latencies, 50),
+		"p90": percentile(latencies, 90),
+		"p99": percentile(latencies, 99),
+		"min": min(latencies),
+		"max": max(latencies),
+		"queries": float(sum(queries)) / len(queries),
+	}
+
+def measure_isolated(grid_class, params, repeat):
+	"""
+	Same as measure() run in a forked child, whose peak memory only grows
+	with this scenario; without fork() peak_rss is not reported.
+	"""
+	if not hasattr(os, "fork"):
+		return dict(measure(grid_class, params, repeat), peak_rss=None)
+	read_fd, write_fd = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(read_fd)
+		status = 0
+		try:
+			result = json.dumps(measure(grid_class, params, repeat))
+		except BaseException as e:
+			result = json.dumps({"error": repr(e)})
+			status = 1
+		with os.fdopen(write_fd, "w") as f:
+			f.write(result)
+		os._exit(status)
+	os.close(write_fd)
+	with os.fdopen(read_fd) as f:
+		result = json.loads(f.read())
+	pid, status, usage = os.wait4(pid, 0)
+	if "error" in result:
+		raise RuntimeError("%s failed: %s" % (grid_class.__name__, result["error"]))
+	result["peak_rss"] = usage.ru_maxrss
+	return result
+
+def revision():
+	try:
+		return subprocess.check_output(["git", "rev-parse", "HEAD"],
+			stderr=subprocess.STDOUT).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def main():
+	parser = OptionParser(usage="python -m benchmarks.grid [options]")
+	parser.add_option("--rows", default="10000",
+		help="comma separated dataset sizes [default: %default]")
+	parser.add_option("--repeat", type="int", default=20,
+		help="requests per scenario [default: %default]")
+	parser.add_option("--only", default="",
+		help="run only the scenarios whose name starts with this prefix")
+	parser.add_option("--output", help="write the results to this file")
+	options, args = parser.parse_args()
+
+	report = {
+		"revision": revision(),
+		"python": sys.version.split()[0],
+		"django": django.get_version(),
+		"repeat": options.repeat,
+		"datasets": {},
+	}
+	for rows in [int(rows) for rows in options.rows.split(",")]:
+		start = time.time()
+		data.build(rows)
+		results = {}
+		for name, grid_class, params in scenarios(rows):
+			if name.startswith(options.only):
+				results[name] = measure_isolated(grid_class, params, options.repeat)
+				sys.stderr.write("%d %s: p50 %.2f ms\n" % (rows, name, results[name]["p50"]))
+		report["datasets"][str(rows)] = {
+			"build_seconds": time.time() - start,
+			"base_rss": peak_rss(),
+			"results": results,
+		}
+
+	output = json.dumps(report, indent=2, sort_keys=True)
+	if options.output:
+		with open(options.output, "w") as f:
+			f.write(output)
+	else:
+		print(output)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,108 @@
+#
+# Django Gems.
+#
+# Copyright (C) 2016 Pier Luigi Fiorini
+#
+# Author: Pier Luigi Fiorini <pierluigi.fiorini@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#	1. Redistributions of source code must retain the above copyright notice,
+#	   this list of conditions and the following disclaimer.
+#
+#	2. Redistributions in binary form must reproduce the above copyright
+#	   notice, this list of conditions and the following disclaimer in the
+#	   documentation and/or other materials provided with the distribution.
+#
+#	3. Neither the name of the project nor the names of its contributors may
+#	   be used to endorse or promote products derived from this software
+#	   without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+"""
+Keyset reads over a nullable column: exports, unpaginated JSON streams and
+cursor pages sorted by rating, which is NULL for some items, must return
+every item exactly once in both orders. Then exports are timed.
+"""
+
+import os, sys, json, time
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+from django.test.client import RequestFactory
+
+from django_gems.jqgrid import JqGrid
+from benchmarks import data
+from benchmarks.models import Item
+
+class ItemGrid(JqGrid):
+	model = Item
+	fields = ["id", "name", "rating"]
+	keyset = True
+	keyset_batch_size = 7
+
+def export_ids(params):
+	rows = list(ItemGrid().get_export_rows(RequestFactory().get("/", params)))[1:]
+	return [row[0] for row in rows]
+
+def stream_ids(params):
+	request = RequestFactory().get("/", dict(params, rows=0))
+	result = json.loads("".join(ItemGrid().get_json_stream(request)))
+	return [row["id"] for row in result["rows"]]
+
+def cursor_ids(params):
+	grid = ItemGrid()
+	ids = []
+	cursor = None
+	while True:
+		page = dict(params, rows=5)
+		if cursor is not None:
+			page[grid.cursor_param] = cursor
+		result = json.loads(ItemGrid().get_json(RequestFactory().get("/", page)))
+		ids.extend([row["id"] for row in result["rows"]])
+		cursor = result["nextCursor"]
+		if cursor is None:
+			return ids
+
+def check():
+	"""
+	Return the names of the reads that miss or repeat items.
+	"""
+	expected = sorted(Item.objects.values_list("pk", flat=True))
+	failed = []
+	for sord in ("asc", "desc"):
+		params = {"sidx": "rating", "sord": sord}
+		for name, read in (("export", export_ids), ("stream", stream_ids), ("cursor", cursor_ids)):
+			ids = read(params)
+			name = "%s/%s" % (name, sord)
+			if sorted(ids) != expected:
+				failed.append(name)
+				print("%s: %d of %d items" % (name, len(set(ids)), len(expected)))
+			else:
+				print("%s: ok" % name)
+	return failed
+
+def main(rows=1000):
+	data.build(rows)
+	failed = check()
+	for sidx in ("id", "rating"):
+		start = time.time()
+		export_ids({"sidx": sidx})
+		print("export by %s: %.1f ms" % (sidx, (time.time() - start) * 1000))
+	return failed
+
+if __name__ == "__main__":
+	sys.exit(main() and 1 or 0)
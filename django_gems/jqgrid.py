@@ -39,51 +39,659 @@
 # Options added:
 #   - distinct
 #   - start_empty
+#   - auto_related
+#   - instrument
+#   - snapshot, snapshot_timeout
+#   - keyset, cursor_param
+#   - count_mode, count_cache_timeout, count_estimate_cap
+#   - concurrent_count, concurrent_workers
+#   - filter_map, filter_cache_size, config_cache_size
+#   - search_fields, search_backend
+#   - stream_chunk_size, keyset_batch_size
+#   - export_formats
+#   - cache_results, cache_timeout, cache_ignored_params
+#   - etag_field, etag_timeout
+#   - aggregates
+#   - coalesce, coalesce_timeout
+#   - project_columns, columns_param
 #
 # Methods added:
+#   - paginate_keyset(): seek pagination, see the keyset option
+#   - iter_keyset(): reads whole result sets a batch at a time
+#   - get_page_result(): builds the response envelope
+#   - count_items(): exact, cached or estimated record counts
+#   - start_count(): count and page fetch in parallel, see concurrent_count
+#   - compile_filters(), get_field_index(): filters are compiled once
+#   - search_items(): text searches through the indexes of search_backend
+#   - get_json_stream(): JSON response as an iterator, see stream_chunk_size
+#   - export(): streams CSV or Excel files, see export_formats
+#   - get_cached(), get_cache_stats(): result cache, see cache_results
+#   - get_projected_field_names(): fetch only displayed columns
+#   - use_distinct(): DISTINCT only when duplicates are possible
+#   - get_related_paths(): select_related/prefetch_related planning
+#   - report_render_queries(): number of queries issued by get_html()
+#   - get_metrics(), report_metrics(): per phase timings, see instrument
+#   - get_json_response(): get_json() with the Server-Timing and ETag headers
+#   - get_config_response(): get_config() with the ETag header
+#   - get_config_key(): get_config() is built once per grid class
+#   - get_aggregates(): userData footer, see aggregates
+#   - get_coalesced(): identical concurrent requests share one computation
+#   - get_etag(), get_etag_key(), get_data_version(): validators for
+#     conditional GETs
+#   - get_snapshot(), get_snapshot_key(), get_snapshot_items(): in-memory
+#     columnar snapshot
 #
 # Other changes:
 #   - field_to_colmodel(): editable set to False
+#   - filter_map: fts operator, full text search of search_backend
 #   - get_queryset(): queryset filtered by all fields in get_field_names()
 #   - filter_items(): use self.get_model() so that self.model is set according
 #                     to the queryset when not explicitely assigned by user
 #   - filter_items(): use lookup_foreign_key_field() to allow searches on
 #                     foreign keys.
 #
+# Classes added:
+#   - GridBatch: data of several grids with one request
+#   - JqGridBase: watches the grid models when the class is defined
+#
 
+import base64
+import copy
+import csv
+import datetime
+import hashlib
 import operator
-from django.db import models
-from django.core.exceptions import FieldError, ImproperlyConfigured
-from django.core.paginator import Paginator, InvalidPage
+import re
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import TimeoutError
+from decimal import Decimal
+from django.db import connections, models, reset_queries
+from django.db.models.signals import class_prepared, post_save, post_delete
+from django.db.models.fields import FieldDoesNotExist
+from django.core.cache import cache
+from django.core.exceptions import FieldError, ImproperlyConfigured, ValidationError
+from django.core.paginator import Paginator, Page, InvalidPage, EmptyPage, PageNotAnInteger
 from django.utils import simplejson as json
-from django.utils.encoding import smart_str
-from django.http import Http404
-from json import json_encode
+from django.utils import translation
+from django.utils.encoding import force_unicode, smart_str
+from django.dispatch import Signal
+from django.http import Http404, HttpResponse, HttpResponseNotModified, \
+	HttpResponseBadRequest, HttpResponseNotAllowed, QueryDict
+from django.template.response import TemplateResponse
+try:
+	from django.http import StreamingHttpResponse
+except ImportError:
+	from django.http import HttpResponse as StreamingHttpResponse
+from json import json_decode, json_encode, json_iterencode
+from snapshot import GridSnapshot
+from utils.db import QueryCounter
+from utils.http import attachment_disposition, etag_matches, make_etag
+from xls import xls_iter
 
 import logging
 logger = logging.getLogger(__name__)
 
+def _generation_key(model):
+	opts = model._meta
+	return "django_gems.jqgrid.generation.%s.%s" % (opts.app_label, opts.object_name.lower())
+
+def get_model_generation(model):
+	"""
+	Return the generation counter of a model, it changes every time an
+	instance is saved or deleted so it can be part of cache keys.
+	"""
+	key = _generation_key(model)
+	generation = cache.get(key)
+	if generation is None:
+		# Start from the current time so that an evicted counter never
+		# goes back to a value used by stale cache entries
+		generation = int(time.time() * 1000)
+		if not cache.add(key, generation):
+			generation = cache.get(key, generation)
+	return generation
+
+def bump_model_generation(model):
+	key = _generation_key(model)
+	try:
+		cache.incr(key)
+	except ValueError:
+		cache.set(key, int(time.time() * 1000))
+
+def _bump_generation_receiver(sender, **kwargs):
+	bump_model_generation(sender)
+
+_watched_models = set()
+
+def watch_model(model):
+	"""
+	Bump the generation of model every time one of its instances is saved
+	or deleted.
+	"""
+	if model in _watched_models:
+		return
+	uid = "django_gems.jqgrid.%s" % _generation_key(model)
+	post_save.connect(_bump_generation_receiver, sender=model, dispatch_uid=uid)
+	post_delete.connect(_bump_generation_receiver, sender=model, dispatch_uid=uid)
+	_watched_models.add(model)
+
+def _get_path_models(model, field_names):
+	"""
+	Return model and the models reached through the __ paths of field_names
+	along with a flag telling if all of them are already loaded.
+	"""
+	models_list = [model]
+	complete = True
+	for field_name in field_names:
+		opts = model._meta
+		for fk_name in field_name.split("__")[:-1]:
+			fields = [f for f in opts.fields if f.name == fk_name]
+			if not fields or fields[0].rel is None:
+				break
+			related = fields[0].rel.to
+			if isinstance(related, basestring):
+				# Lazy relation, resolved when the related model is prepared
+				complete = False
+				break
+			if related not in models_list:
+				models_list.append(related)
+			opts = related._meta
+	return models_list, complete
+
+_pending_grids = set()
+
+def _watch_grid(cls):
+	"""
+	Watch the model of a grid class and the models of its fields.
+	"""
+	model = cls.model
+	if model is None and cls.queryset is not None:
+		model = cls.queryset.model
+	if model is None:
+		return
+	field_names = cls.fields or [f.name for f in model._meta.local_fields]
+	models_list, complete = _get_path_models(model, field_names)
+	for related in models_list:
+		watch_model(related)
+	if cls.search_backend is not None and cls.search_fields:
+		# Backends may keep their index up to date with signals, they
+		# have to listen in every process
+		_get_search_backend(cls, model)
+	if complete:
+		_pending_grids.discard(cls)
+	else:
+		_pending_grids.add(cls)
+
+def _watch_pending_grids(sender, **kwargs):
+	for cls in list(_pending_grids):
+		_watch_grid(cls)
+
+class_prepared.connect(_watch_pending_grids, dispatch_uid="django_gems.jqgrid.watch_grids")
+
+class JqGridBase(type):
+	"""
+	Watches the models of a grid when the class is defined, so that saves
+	bump their generations even in processes that haven't served the grid.
+	"""
+	def __init__(cls, name, bases, attrs):
+		super(JqGridBase, cls).__init__(name, bases, attrs)
+		_watch_grid(cls)
+
+# Database vendors that sort NULLs after every other value in ascending
+# order, the others sort them first
+NULLS_LARGEST_VENDORS = ("postgresql", "oracle")
+
+# Lookups that compare strings, search data is not converted for them
+TEXT_LOOKUPS = ("iexact", "startswith", "endswith", "contains", "icontains")
+
+# Fields whose to_python() converts search data to the column type
+COERCED_TYPES = ("AutoField", "IntegerField", "BigIntegerField", "SmallIntegerField",
+	"PositiveIntegerField", "PositiveSmallIntegerField", "FloatField", "DecimalField",
+	"DateField", "DateTimeField", "TimeField")
+
+# What jqGrid sends for the values of a NullBooleanField
+NULL_BOOLEAN_DATA = {"true": True, "false": False, "null": None}
+
+# Always true and always false conditions, for search data that doesn't
+# fit the searched field
+MATCH_ALL = models.Q(pk__isnull=False)
+MATCH_NONE = models.Q(pk__in=[])
+
+# Aggregate functions for the footer, see JqGrid.aggregates
+AGGREGATES = {
+	"sum": models.Sum,
+	"avg": models.Avg,
+	"min": models.Min,
+	"max": models.Max,
+	"count": models.Count,
+}
+
+# Field metadata, compiled filters, related paths and configurations, see
+# JqGrid.get_field_index(), compile_filters(), get_related_paths() and
+# get_config()
+_field_indexes = {}
+_configs = {}
+_compiled_filters = {}
+_related_paths = {}
+_search_backends = {}
+
+def _get_search_backend(cls, model):
+	key = (cls, model)
+	backend = _search_backends.get(key)
+	if backend is None:
+		backend = _search_backends[key] = cls.search_backend(model, cls.search_fields)
+	return backend
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+_cache_stats = {}
+_cache_stats_lock = threading.Lock()
+
+def _count_cache_access(grid_class, outcome):
+	with _cache_stats_lock:
+		stats = _cache_stats.setdefault(grid_class, {"hits": 0, "misses": 0})
+		stats[outcome] += 1
+
+# Worker pools by (name, number of workers), see _run_concurrently()
+_pools = {}
+_pools_lock = threading.Lock()
+_worker = threading.local()
+
+def _in_worker():
+	"""
+	Tell whether the current thread is a worker of one of the pools.
+	"""
+	return getattr(_worker, "active", False)
+
+def _can_use_other_connections(using):
+	"""
+	Tell whether other connections see the same data as the one of the
+	current thread: not within a transaction nor with an in-memory SQLite
+	database.
+	"""
+	connection = connections[using]
+	if getattr(connection, "in_atomic_block", False):
+		return False
+	if connection.vendor == "sqlite" and \
+			connection.settings_dict["NAME"] in ("", ":memory:"):
+		return False
+	return True
+
+def _run_concurrently(func, using, pool, workers, count_queries=False):
+	"""
+	Run func on a thread of the pool named pool, which has workers threads
+	with their own database connections, and return an AsyncResult of
+	(result, duration, queries); queries are counted only with
+	count_queries.
+	Tasks must not wait for other tasks of the same pool, the pool could
+	be full of tasks waiting for queued ones.
+	"""
+	key = (pool, workers)
+	with _pools_lock:
+		if key not in _pools:
+			from multiprocessing.pool import ThreadPool
+			_pools[key] = ThreadPool(workers)
+
+	def task():
+		_worker.active = True
+		connection = connections[using]
+		close = getattr(connection, "close_if_unusable_or_obsolete", connection.close)
+		close()
+		start = time.time()
+		try:
+			if not count_queries:
+				return (func(), (time.time() - start) * 1000, 0)
+			with QueryCounter(using) as counter:
+				value = func()
+			return (value, (time.time() - start) * 1000, counter.count)
+		finally:
+			# Like at the end of a request: no request_started signal
+			# empties the queries logged by the debug cursor here
+			reset_queries()
+			# Honor CONN_MAX_AGE
+			close()
+	return _pools[key].apply_async(task)
+
+class CoalescingError(Exception):
+	"""
+	The computation shared by identical requests failed in another process.
+	"""
+	pass
+
+class _Flight(object):
+	"""
+	A computation in progress, waited for by identical requests.
+	"""
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+def _single_flight(key, func, timeout):
+	"""
+	Return func(), when another thread of this process is already running
+	it for the same key wait up to timeout seconds for its result or
+	error. Past the timeout the waiting thread computes the result itself.
+	"""
+	with _flights_lock:
+		flight = _flights.get(key)
+		leader = flight is None
+		if leader:
+			flight = _flights[key] = _Flight()
+	if not leader:
+		if not flight.done.wait(timeout):
+			return func()
+		if flight.error is not None:
+			raise flight.error
+		return flight.result
+	try:
+		flight.result = func()
+		return flight.result
+	except Exception as e:
+		flight.error = e
+		raise
+	finally:
+		with _flights_lock:
+			del _flights[key]
+		flight.done.set()
+
+def _cache_flight(key, func, timeout, poll=0.05):
+	"""
+	Same as _single_flight() across processes: the lock and the outcome
+	live in the cache, which must be shared by all of them. Errors reach
+	the other processes as CoalescingError.
+	"""
+	lock_key = key + ".lock"
+	outcome_key = key + ".outcome"
+	if cache.add(lock_key, 1, timeout):
+		cache.delete(outcome_key)
+		try:
+			result = func()
+		except Exception as e:
+			cache.set(outcome_key, (False, force_unicode(e)), timeout)
+			raise
+		else:
+			cache.set(outcome_key, (True, result), timeout)
+		finally:
+			cache.delete(lock_key)
+		return result
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		time.sleep(poll)
+		outcome = cache.get(outcome_key)
+		if outcome is not None:
+			success, value = outcome
+			if not success:
+				raise CoalescingError(value)
+			return value
+		if cache.get(lock_key) is None:
+			# The lock expired without an outcome
+			break
+	return func()
+
+class _Echo(object):
+	"""
+	File-like object that returns what is written, used to get lines out
+	of csv.writer.
+	"""
+	def write(self, value):
+		return value
+
+def _aggregate(items, **kwargs):
+	"""
+	QuerySet.aggregate() working on values() querysets too, before Django
+	1.8 they mask any aggregate missing from values().
+	"""
+	if getattr(items.query, "aggregate_select_mask", None) is not None:
+		items = items._clone()
+		items.query.set_aggregate_mask(None)
+	return items.aggregate(**kwargs)
+
+def _has_multivalued_joins(query):
+	"""
+	Return whether query joins a relation that can match more than one
+	row. Forward relations are joined through their field while reverse
+	ones are joined through a relation object, unique only for one to one.
+	"""
+	base_alias = query.tables and query.tables[0] or None
+	for alias, join in query.alias_map.items():
+		if alias == base_alias:
+			continue
+		join_field = getattr(join, "join_field", None)
+		if join_field is None:
+			# Django without join information, assume the worst
+			return True
+		if isinstance(join_field, models.Field):
+			continue
+		if not getattr(getattr(join_field, "field", None), "unique", False):
+			return True
+	return False
+
+class GridTemplateResponse(TemplateResponse):
+	"""
+	Template response that counts the queries issued while rendering, the
+	number is stored into query_count and reported to the grid.
+	"""
+	def __init__(self, grid, request, template, context=None, **kwargs):
+		TemplateResponse.__init__(self, request, template, context, **kwargs)
+		self.grid = grid
+		self.query_count = None
+
+	@property
+	def rendered_content(self):
+		with QueryCounter() as counter:
+			content = super(GridTemplateResponse, self).rendered_content
+		self.query_count = counter.count
+		self.grid.report_render_queries(self._request, counter.count)
+		return content
+
+# Sent at the end of instrumented grid requests
+grid_metrics = Signal(providing_args=["grid", "request", "metrics"])
+
+class GridMetrics(object):
+	"""
+	Time, number of queries and number of rows of each phase of a grid
+	request. Phases can be nested, the time and the queries of a phase
+	don't include the ones of its inner phases.
+	"""
+	def __init__(self, enabled=True):
+		self.enabled = enabled
+		self.phases = []
+		self.rows = None
+		self.cache = None
+		self._stack = []
+
+	@contextmanager
+	def phase(self, name):
+		if not self.enabled:
+			yield
+			return
+		# Inner phases add their totals to the frame of the outer one
+		frame = [0.0, 0]
+		self._stack.append(frame)
+		start = time.time()
+		try:
+			with QueryCounter() as counter:
+				yield
+		finally:
+			self._stack.pop()
+			duration = (time.time() - start) * 1000
+			queries = counter.count
+			if self._stack:
+				self._stack[-1][0] += duration
+				self._stack[-1][1] += queries
+			self.phases.append((name, duration - frame[0], queries - frame[1]))
+
+	def record(self, name, duration, queries):
+		"""
+		Add a phase measured elsewhere, for example on another thread.
+		"""
+		if self.enabled:
+			self.phases.append((name, duration, queries))
+
+	def as_dict(self):
+		return {
+			"phases": [{"name": name, "duration": round(duration, 3), "queries": queries}
+				for name, duration, queries in self.phases],
+			"queries": sum([queries for name, duration, queries in self.phases]),
+			"rows": self.rows,
+			"cache": self.cache,
+		}
+
+	def server_timing(self):
+		"""
+		Return the value of a Server-Timing header.
+		"""
+		entries = ["%s;dur=%.3f" % (name, duration)
+			for name, duration, queries in self.phases]
+		if self.cache is not None:
+			entries.append('cache;desc="%s"' % self.cache)
+		return ", ".join(entries)
+
+class GridPaginator(Paginator):
+	"""
+	Paginator that asks counter for the number of objects, counter returns
+	a (count, mode) pair and mode is stored into count_mode.
+	Capped and estimated counts may be lower than the real number: pages
+	past them are served as long as they have rows, and num_pages is one
+	more than the page served while it's full.
+	"""
+	def __init__(self, object_list, per_page, counter=None, **kwargs):
+		Paginator.__init__(self, object_list, per_page, **kwargs)
+		self.counter = counter
+		self.count_mode = "exact"
+		self.last_page = None
+
+	def _get_count(self):
+		if self._count is None and self.counter is not None:
+			self._count, self.count_mode = self.counter(self.object_list)
+		return Paginator._get_count(self)
+	count = property(_get_count)
+
+	def is_open_ended(self):
+		return self.count is not None and self.count_mode in ("capped", "estimated")
+
+	def _get_num_pages(self):
+		num_pages = Paginator._get_num_pages(self)
+		if self.is_open_ended() and self.last_page is not None:
+			return max(num_pages, self.last_page)
+		return num_pages
+	num_pages = property(_get_num_pages)
+
+	def validate_number(self, number):
+		if not self.is_open_ended():
+			return Paginator.validate_number(self, number)
+		try:
+			number = int(number)
+		except (TypeError, ValueError):
+			raise PageNotAnInteger("That page number is not an integer")
+		if number < 1:
+			raise EmptyPage("That page number is less than 1")
+		return number
+
+	def page(self, number):
+		number = self.validate_number(number)
+		if not self.is_open_ended():
+			return Paginator.page(self, number)
+		bottom = (number - 1) * self.per_page
+		return self.page_of(list(self.object_list[bottom:bottom + self.per_page]), number)
+
+	def page_of(self, rows, number):
+		"""
+		Return page number made of rows, already fetched.
+		"""
+		if self.is_open_ended():
+			self.last_page = len(rows) >= self.per_page and number + 1 or number
+		return Page(rows, number, self)
+
 class JqGrid(object):
+	__metaclass__ = JqGridBase
+
 	queryset = None
 	model = None
 	fields = []
 	allow_empty = True
-	distinct = True
+	distinct = "auto"
 	start_empty = False
+	auto_related = True
+	instrument = False
+	metrics = None
+	snapshot = False
+	snapshot_timeout = 3600
+	keyset = False
+	cursor_param = "cursor"
+	count_mode = "exact"
+	count_cache_timeout = 300
+	count_estimate_cap = 10000
+	concurrent_count = False
+	concurrent_workers = 4
+	concurrent_timeout = 30
 
 	pager_id = "#pager"
 	url = None
 	caption = None
 	colmodel_overrides = {}
+	config_attributes = ("pager_id", "fields", "colmodel_overrides", "aggregates")
+
+	filter_map = {
+		# jqgrid op: (django_lookup, use_exclude)
+		"ne": ("%(field)s__exact", True),
+		"bn": ("%(field)s__startswith", True),
+		"en": ("%(field)s__endswith",  True),
+		"nc": ("%(field)s__contains", True),
+		"ni": ("%(field)s__in", True),
+		"in": ("%(field)s__in", False),
+		"eq": ("%(field)s__exact", False),
+		"ieq": ("%(field)s__iexact", False),
+		"bw": ("%(field)s__startswith", False),
+		"gt": ("%(field)s__gt", False),
+		"ge": ("%(field)s__gte", False),
+		"lt": ("%(field)s__lt", False),
+		"le": ("%(field)s__lte", False),
+		"ew": ("%(field)s__endswith", False),
+		"cn": ("%(field)s__contains", False),
+		"icn": ("%(field)s__icontains", False),
+		# Full text search of search_backend, icontains without one
+		"fts": ("%(field)s__icontains", False)
+	}
+	filter_cache_size = 256
+	config_cache_size = 256
+	search_fields = []
+	search_backend = None
+	stream_chunk_size = 100
+	keyset_batch_size = 2000
+
+	project_columns = False
+	columns_param = "columns"
+	cache_results = False
+	cache_timeout = 60
+	cache_ignored_params = ("nd", "_")
+	etag_field = None
+	etag_timeout = None
+	aggregates = {}
+	aggregate_values = None
+	coalesce = False
+	coalesce_timeout = 10
+
+	export_formats = {
+		# format: (content type, file extension)
+		"csv": ("text/csv", "csv"),
+		"xls": ("application/vnd.ms-excel", "xls"),
+	}
 
 	def get_queryset(self, request):
+		field_names = self.get_projected_field_names(request)
 		if hasattr(self, "queryset") and self.queryset is not None:
-			queryset = self.queryset.values(*self.get_field_names())._clone()
+			queryset = self.queryset.values(*field_names)._clone()
 		elif hasattr(self, "model") and self.model is not None:
-			queryset = self.model.objects.values(*self.get_field_names())
+			queryset = self.model.objects.values(*field_names)
 		else:
 			raise ImproperlyConfigured("No queryset or model defined.")
-		if self.distinct:
+		if self.use_distinct(request, field_names):
 			self.queryset = queryset.distinct()
 		else:
 			self.queryset = queryset
@@ -93,15 +701,116 @@ class JqGrid(object):
 		if hasattr(self, "queryset") and self.queryset is not None:
 			queryset = self.queryset._clone()
 		elif hasattr(self, "model") and self.model is not None:
-			queryset = self.model.objects
+			queryset = self.model.objects.all()
 		else:
 			raise ImproperlyConfigured("No queryset or model defined.")
-		if self.distinct:
+		if self.auto_related:
+			select, prefetch = self.get_related_paths()
+			if select:
+				queryset = queryset.select_related(*select)
+			if prefetch:
+				queryset = queryset.prefetch_related(*prefetch)
+		if self.use_distinct(request, []):
 			self.queryset = queryset.distinct()
 		else:
 			self.queryset = queryset
 		return self.queryset
 
+	def use_distinct(self, request, field_names):
+		"""
+		Return whether the queryset needs DISTINCT.
+		True or False force it on or off, with "auto" DISTINCT is used only
+		when the query can return duplicates: that is when a multi-valued
+		relation (reverse foreign key or many to many) is joined by the
+		queryset, by the fetched field_names or by the search filters.
+		"""
+		if self.distinct != "auto":
+			return self.distinct
+		if self.queryset is not None and _has_multivalued_joins(self.queryset.query):
+			return True
+		field_names = list(field_names)
+		filters = self.get_filters(request)
+		if filters:
+			field_names.extend([rule["field"] for rule in filters["rules"]])
+		opts = self.get_model()._meta
+		for field_name in field_names:
+			if self.is_multivalued_path(opts, field_name):
+				return True
+		return False
+
+	def is_multivalued_path(self, options, field_name):
+		"""
+		Return whether following field_name from options goes through a
+		relation that can match more than one row.
+		"""
+		for name in field_name.split("__"):
+			try:
+				field, model, direct, m2m = options.get_field_by_name(name)
+			except FieldDoesNotExist:
+				# Not a path, the ORM will complain if needed
+				return False
+			if m2m:
+				return True
+			if not direct:
+				# Reverse relation, single-valued only for one to one
+				if not field.field.unique:
+					return True
+				options = field.model._meta
+			elif field.rel is not None:
+				options = field.rel.to._meta
+			else:
+				break
+		return False
+
+	def get_related_paths(self):
+		"""
+		Return the (select_related, prefetch_related) paths needed to display
+		the fields and the colmodel of the grid without a query per row.
+		Single-valued relations are joined, multi-valued ones are prefetched.
+		"""
+		key = (self.__class__, self.get_model())
+		paths = _related_paths.get(key)
+		if paths is not None:
+			return paths
+		select, prefetch = [], []
+		field_names = list(self.get_field_names())
+		field_names.extend([name for name in self.colmodel_overrides
+			if name not in field_names])
+		for field_name in field_names:
+			options = self.get_model()._meta
+			names = field_name.split("__")
+			relation, multivalued = [], False
+			for name in names:
+				try:
+					field, model, direct, m2m = options.get_field_by_name(name)
+				except FieldDoesNotExist:
+					break
+				if m2m:
+					multivalued = True
+					options = (direct and field.rel.to or field.model)._meta
+					if not direct:
+						name = field.get_accessor_name()
+				elif not direct:
+					multivalued = multivalued or not field.field.unique
+					options = field.model._meta
+					# Related managers are reached through their accessor
+					name = field.get_accessor_name()
+				elif field.rel is not None:
+					options = field.rel.to._meta
+				else:
+					break
+				relation.append(name)
+			if not relation:
+				continue
+			path = "__".join(relation)
+			if multivalued:
+				if path not in prefetch:
+					prefetch.append(path)
+			elif path not in select:
+				select.append(path)
+		paths = _related_paths[key] = (select, prefetch)
+		return paths
+
 	def get_model(self):
 		if hasattr(self, "model") and self.model is not None:
 			model = self.model
@@ -113,12 +822,119 @@ class JqGrid(object):
 		return model
 
 	def get_items(self, request):
-		items = self.get_queryset(request)
-		items = self.filter_items(request, items)
-		items = self.sort_items(request, items)
-		paginator, page, items = self.paginate_items(request, items)
+		metrics = self.get_metrics()
+		self.aggregate_values = None
+		if self.snapshot:
+			with metrics.phase("snapshot"):
+				result = self.get_snapshot_items(request)
+			if result is not None:
+				return result
+		with metrics.phase("queryset"):
+			items = self.get_queryset(request)
+		with metrics.phase("filter"):
+			items = self.filter_items(request, items)
+		with metrics.phase("sort"):
+			items = self.sort_items(request, items)
+		with metrics.phase("paginate"):
+			paginator, page, items = self.paginate_items(request, items)
+		if metrics.enabled and paginator is not None:
+			# Fetch the page now, otherwise it would happen while encoding;
+			# without pagination items stays a queryset, it's still counted
+			with metrics.phase("fetch"):
+				items = list(items)
+			metrics.rows = len(items)
 		return (paginator, page, items)
 
+	def get_snapshot(self, request):
+		"""
+		Return the in-memory snapshot of the grid, loading it when missing,
+		older than snapshot_timeout seconds or when one of the models it
+		was loaded from has been saved or deleted since.
+		Returns None when NumPy is not installed or when get_snapshot_key()
+		returns None.
+		"""
+		snapshot_key = self.get_snapshot_key(request)
+		if snapshot_key is None:
+			return None
+		key = (self.__class__, self.get_model(), snapshot_key)
+		models_list = self.get_related_models(self.get_field_names())
+		generations = [get_model_generation(model) for model in models_list]
+		snapshot = _snapshots.get(key)
+		if snapshot is not None and snapshot.is_fresh(self.snapshot_timeout, generations):
+			return snapshot
+		with _snapshots_lock:
+			snapshot = _snapshots.get(key)
+			if snapshot is None or not snapshot.is_fresh(self.snapshot_timeout, generations):
+				try:
+					snapshot = GridSnapshot(self, request, generations)
+				except ImportError:
+					logger.warning("NumPy is not available, %s can't use a snapshot",
+						self.__class__.__name__)
+					return None
+				_snapshots[key] = snapshot
+		return snapshot
+
+	def get_snapshot_key(self, request):
+		"""
+		Return what tells apart the snapshots of the grid, one is loaded
+		for each key. The rows of grids overriding get_queryset() may
+		depend on the request, so they don't use a snapshot unless they
+		override this too, for example returning request.user.pk.
+		"""
+		if self.__class__.get_queryset.__func__ is not JqGrid.get_queryset.__func__:
+			return None
+		return ()
+
+	def get_snapshot_items(self, request):
+		"""
+		Same as get_items() but served by the snapshot, returns None when
+		the request needs the database (sorting or searching on fields that
+		are not in the snapshot).
+		"""
+		snapshot = self.get_snapshot(request)
+		if snapshot is None:
+			return None
+		indexes = snapshot.filter(self, self.get_filters(request))
+		if indexes is None:
+			return None
+		sidx = request.GET.get("sidx")
+		if sidx:
+			indexes = snapshot.sort(indexes, sidx, request.GET.get("sord") == "desc")
+			if indexes is None:
+				return None
+		rows = snapshot.rows(indexes, self.get_projected_field_names(request))
+		paginate_by = self.get_paginate_by(request) or max(len(rows), 1)
+		paginator = GridPaginator(rows, paginate_by,
+			allow_empty_first_page=self.allow_empty)
+		try:
+			page = paginator.page(int(request.GET.get("page", 1)))
+		except (ValueError, InvalidPage):
+			page = paginator.page(1)
+		return (paginator, page, page.object_list)
+
+	def get_metrics(self):
+		if self.metrics is None:
+			self.metrics = GridMetrics(self.instrument)
+		return self.metrics
+
+	def report_metrics(self, request, metrics):
+		"""
+		Called at the end of an instrumented request, logs the metrics as a
+		structured record and sends the grid_metrics signal, connect to it
+		or override this to feed a metrics backend.
+		"""
+		name = "%s.%s" % (self.__class__.__module__, self.__class__.__name__)
+		logger.info("%s %s", name, metrics.server_timing(),
+			extra={"grid": name, "metrics": metrics.as_dict()})
+		grid_metrics.send(sender=self.__class__, grid=self, request=request,
+			metrics=metrics)
+
+	def finish_metrics(self, request):
+		metrics = self.get_metrics()
+		if metrics.enabled:
+			self.report_metrics(request, metrics)
+		return metrics
+
 	def get_filters(self, request):
 		_search = request.GET.get("_search")
 		_export = request.GET.get("_export")
@@ -147,59 +963,173 @@ class JqGrid(object):
 	def filter_items(self, request, items):
 		# TODO: Add option to use case insensitive filters
 		# TODO: Add more support for RelatedFields (searching and displaying)
-		# FIXME: Validate data types are correct for field being searched.
-		filter_map = {
-			# jqgrid op: (django_lookup, use_exclude)
-			"ne": ("%(field)s__exact", True),
-			"bn": ("%(field)s__startswith", True),
-			"en": ("%(field)s__endswith",  True),
-			"nc": ("%(field)s__contains", True),
-			"ni": ("%(field)s__in", True),
-			"in": ("%(field)s__in", False),
-			"eq": ("%(field)s__exact", False),
-			"ieq": ("%(field)s__iexact", False),
-			"bw": ("%(field)s__startswith", False),
-			"gt": ("%(field)s__gt", False),
-			"ge": ("%(field)s__gte", False),
-			"lt": ("%(field)s__lt", False),
-			"le": ("%(field)s__lte", False),
-			"ew": ("%(field)s__endswith", False),
-			"cn": ("%(field)s__contains", False),
-			"icn": ("%(field)s__icontains", False)
-		}
 		_filters = self.get_filters(request)
 		if _filters is None:
 			return items
+		items, _filters = self.search_items(request, items, _filters)
+		if not _filters["rules"]:
+			return items
+		return items.filter(self.compile_filters(_filters))
+
+	def get_search_backend(self):
+		"""
+		Return the search_backend instance bound to the search_fields of the
+		grid, or None when the grid doesn't have one.
+		"""
+		if self.search_backend is None or not self.search_fields:
+			return None
+		return _get_search_backend(self.__class__, self.get_model())
+
+	def search_items(self, request, items, filters):
+		"""
+		Hand the rules the search backend supports over to it and return
+		the searched items together with the remaining filters.
+		Only AND groups are split, with OR every rule has to be a lookup.
+		Results are ranked when the client doesn't sort (empty sidx).
+		"""
+		backend = self.get_search_backend()
+		if backend is None:
+			return (items, filters)
+		if filters["groupOp"].upper() == "OR" and len(filters["rules"]) > 1:
+			return (items, filters)
+		rank = not request.GET.get("sidx")
+		rules = []
+		for rule in filters["rules"]:
+			searched = None
+			if backend.supports(rule["field"], rule["op"]):
+				searched = backend.apply(items, rule["field"], rule["op"], rule["data"], rank)
+			if searched is None:
+				rules.append(rule)
+			else:
+				items = searched
+				rank = False
+		return (items, dict(filters, rules=rules))
+
+	def compile_filters(self, filters):
+		"""
+		Return the Q object for filters, compiled filters are cached per
+		grid class and keyed by the normalized filters.
+		"""
+		key = (self.__class__, self.get_model(), json.dumps(filters, sort_keys=True))
+		q = _compiled_filters.get(key)
+		if q is None:
+			q = self.build_filters(filters)
+			if len(_compiled_filters) >= self.filter_cache_size:
+				_compiled_filters.clear()
+			_compiled_filters[key] = q
+		return q
 
+	def build_filters(self, filters):
 		q_filters = []
-		for rule in _filters["rules"]:
+		for rule in filters["rules"]:
 			op, field, data = rule["op"], rule["field"], rule["data"]
-			opts = self.get_model()._meta
-			field_class = self.lookup_foreign_key_field(opts, field)[0]
-			filter_fmt, exclude = filter_map[op]
+			field_class, internal_type, coerce = self.get_field_info(field)
+			filter_fmt, exclude = self.filter_map[op]
 			filter_str = smart_str(filter_fmt % {"field": field})
-			if filter_fmt.endswith("__in"):
-				d_split = data.split(",")
-				filter_kwargs = {filter_str: data.split(",")}
-			else:
-				if field_class.get_internal_type() == "BooleanField":
-					# Boolean fields have a special treatment
-					filter_value = False
-					if smart_str(data) == "true": filter_value = True
-					filter_kwargs = {filter_str: filter_value}
-				else:
+			lookup = filter_fmt.rsplit("__", 1)[-1]
+			try:
+				if lookup == "in":
+					values = self.coerce_values(coerce, data.split(","))
+					if not values:
+						raise ValidationError("No valid value in %r" % data)
+					filter_kwargs = {filter_str: values}
+				elif lookup in TEXT_LOOKUPS:
 					filter_kwargs = {filter_str: smart_str(data)}
+				else:
+					filter_kwargs = {filter_str: coerce(data)}
+			except ValidationError as e:
+				# Data that doesn't fit the field matches no row: the rule
+				# is false for every row, true when negated
+				logger.debug("Invalid search rule %s: %s", rule, e)
+				q_filters.append(exclude and MATCH_ALL or MATCH_NONE)
+				continue
 			# Append the filters to the list
 			if exclude:
 				q_filters.append(~models.Q(**filter_kwargs))
 			else:
 				q_filters.append(models.Q(**filter_kwargs))
 		# Filter the data
-		if _filters["groupOp"].upper() == "OR":
-			filters = reduce(operator.ior, q_filters)
+		if filters["groupOp"].upper() == "OR":
+			return reduce(operator.ior, q_filters)
+		return reduce(operator.iand, q_filters)
+
+	def coerce_values(self, coerce, values):
+		"""
+		Return the values that coerce accepts, converted; the other ones
+		can't match any row.
+		"""
+		coerced = []
+		for value in values:
+			try:
+				coerced.append(coerce(value))
+			except ValidationError:
+				pass
+		return coerced
+
+	def get_field_index(self):
+		"""
+		Return a dict that maps each field path of the grid to a
+		(field, internal type, coercer) tuple, built once per grid class.
+		"""
+		model = self.get_model()
+		key = (self.__class__, model)
+		index = _field_indexes.get(key)
+		if index is None:
+			index = {}
+			for field_name in self.get_field_names():
+				index[field_name] = self.resolve_field(model._meta, field_name)
+			_field_indexes[key] = index
+		return index
+
+	def get_field_info(self, field_name):
+		index = self.get_field_index()
+		info = index.get(field_name)
+		if info is None:
+			# Searches are allowed on paths that are not displayed
+			info = self.resolve_field(self.get_model()._meta, field_name)
+			index[field_name] = info
+		return info
+
+	def resolve_field(self, options, field_name):
+		field = self.lookup_foreign_key_field(options, field_name)[0]
+		internal_type = field.get_internal_type()
+		return (field, internal_type, self.get_field_coercer(field, internal_type))
+
+	def get_field_coercer(self, field, internal_type):
+		"""
+		Return the function that converts search data to the type of field,
+		so that the database compares values of the same type and can use
+		its indexes. The function raises ValidationError for invalid data.
+		Text lookups (contains, startswith...) always get strings.
+		"""
+		if internal_type == "BooleanField":
+			# Boolean fields have a special treatment
+			return lambda data: smart_str(data) == "true"
+		if internal_type == "NullBooleanField":
+			def coerce(data):
+				key = smart_str(data).lower()
+				if key in NULL_BOOLEAN_DATA:
+					return NULL_BOOLEAN_DATA[key]
+				return field.to_python(data)
+			return coerce
+		if field.rel is not None:
+			# Foreign keys are searched by the id of the related object
+			target = field.rel.get_related_field()
+			return self.get_field_coercer(target, target.get_internal_type())
+		if internal_type in COERCED_TYPES:
+			to_python = field.to_python
 		else:
-			filters = reduce(operator.iand, q_filters)
-		return items.filter(filters)
+			# Unicode, what the database returns and the snapshot holds
+			to_python = force_unicode
+		if field.choices:
+			choices = set([smart_str(key) for key, label in field.flatchoices])
+			def coerce(data):
+				value = to_python(data)
+				if smart_str(value) not in choices:
+					raise ValidationError("%r is not a valid choice" % data)
+				return value
+			return coerce
+		return to_python
 
 	def sort_items(self, request, items):
 		sidx = request.GET.get("sidx")
@@ -220,22 +1150,367 @@ class JqGrid(object):
 			paginate_by = 10
 		return paginate_by
 
+	def get_paginator(self, request, items, paginate_by):
+		def counter(object_list):
+			with self.get_metrics().phase("count"):
+				return self.count_items(request, object_list)
+		return GridPaginator(items, paginate_by, counter=counter,
+			allow_empty_first_page=self.allow_empty)
+
+	def count_items(self, request, items):
+		"""
+		Count items according to count_mode, returns a (count, mode) pair:
+		  - "exact": SELECT COUNT(*) every time
+		  - "cached": exact count stored in the cache for count_cache_timeout
+		    seconds, saving or deleting a model instance invalidates it
+		  - "estimated": the planner estimate where the backend has one,
+		    otherwise a count that stops at count_estimate_cap; the mode is
+		    "exact" when the count didn't reach the cap and "capped" when
+		    the real number is at least that
+		"""
+		if self.count_mode == "cached":
+			key = self.get_count_cache_key(request, items)
+			count = cache.get(key)
+			if count is None:
+				count = items.count()
+				cache.set(key, count, self.count_cache_timeout)
+			return (count, "cached")
+		elif self.count_mode == "estimated":
+			count = self.estimate_count(items)
+			if count is not None:
+				return (count, "estimated")
+			count = self.capped_count(items, self.count_estimate_cap)
+			if count > self.count_estimate_cap:
+				return (self.count_estimate_cap, "capped")
+			return (count, "exact")
+		if self.aggregates and hasattr(items, "aggregate") and not items.query.distinct:
+			# The footer comes with the count
+			values = _aggregate(items, _records=models.Count("pk"),
+				**self.get_aggregate_expressions())
+			self.aggregate_values = values
+			return (values.pop("_records"), "exact")
+		return (items.count(), "exact")
+
+	def get_aggregate_expressions(self):
+		"""
+		Return the aggregate() arguments for the aggregates option, a dict
+		that maps field names to sum, avg, min, max or count.
+		"""
+		expressions = {}
+		for field_name, function in self.aggregates.items():
+			if function not in AGGREGATES:
+				raise ImproperlyConfigured("Unknown aggregate %s for %s" % (function, field_name))
+			expressions["%s__%s" % (field_name, function)] = AGGREGATES[function](field_name)
+		return expressions
+
+	def get_aggregates(self, request, items):
+		"""
+		Return the aggregates of the filtered items as the userData of the
+		footer, computed by count_items() along with an exact count when
+		possible, otherwise with one more query.
+		"""
+		values = self.aggregate_values
+		if values is None:
+			if not hasattr(items, "aggregate"):
+				# Snapshot rows, ask the database
+				items = self.filter_items(request, self.get_queryset(request))
+			with self.get_metrics().phase("aggregate"):
+				values = _aggregate(items, **self.get_aggregate_expressions())
+		return dict([(field_name, values["%s__%s" % (field_name, function)])
+			for field_name, function in self.aggregates.items()])
+
+	def get_count_cache_key(self, request, items):
+		"""
+		The key is made of the grid class, the generations of the models
+		returned by get_cache_models(), the normalized filters and the SQL
+		of the query (so that grids with per-request querysets never share
+		counts).
+		"""
+		generations = [get_model_generation(model) for model in self.get_cache_models(request)]
+		filters = json.dumps(self.get_filters(request), sort_keys=True)
+		sql, params = items.query.sql_with_params()
+		signature = hashlib.md5(smart_str(u"%s|%s|%r" % (filters, sql, params))).hexdigest()
+		return "django_gems.jqgrid.count.%s.%s.%s.%s" % (self.__class__.__module__,
+			self.__class__.__name__, "-".join(map(str, generations)), signature)
+
+	def estimate_count(self, items):
+		"""
+		Return the number of rows estimated by the query planner or None when
+		the backend doesn't provide an estimate.
+		"""
+		connection = connections[items.db]
+		if connection.vendor != "postgresql":
+			return None
+		sql, params = items.query.sql_with_params()
+		cursor = connection.cursor()
+		cursor.execute("EXPLAIN " + sql, params)
+		match = re.search(r"rows=(\d+)", cursor.fetchone()[0])
+		if match is None:
+			return None
+		return int(match.group(1))
+
+	def capped_count(self, items, cap):
+		"""
+		Count at most cap + 1 items, the database stops scanning after that.
+		"""
+		connection = connections[items.db]
+		sql, params = items[:cap + 1].query.sql_with_params()
+		cursor = connection.cursor()
+		cursor.execute("SELECT COUNT(*) FROM (%s) capped" % sql, params)
+		return cursor.fetchone()[0]
+
 	def paginate_items(self, request, items):
+		if self.keyset:
+			return self.paginate_keyset(request, items)
 		paginate_by = self.get_paginate_by(request)
 		if not paginate_by:
 			return (None, None, items)
 
-		paginator = Paginator(items, paginate_by,
-			allow_empty_first_page=self.allow_empty)
-		page = request.GET.get("page", 1)
-
+		paginator = self.get_paginator(request, items, paginate_by)
 		try:
-			page_number = int(page)
-			page = paginator.page(page_number)
-		except (ValueError, InvalidPage):
-			page = paginator.page(1)
+			page_number = int(request.GET.get("page", 1))
+		except ValueError:
+			page_number = 1
+		page = self.get_page(request, paginator, page_number)
 		return (paginator, page, page.object_list)
 
+	def get_page(self, request, paginator, page_number):
+		"""
+		Return page page_number of paginator, or the first one when it
+		doesn't exist. With concurrent_count the rows are fetched while the
+		count runs on another connection.
+		"""
+		join_count = self.start_count(request, paginator)
+		if join_count is None:
+			try:
+				return paginator.page(page_number)
+			except InvalidPage:
+				return paginator.page(1)
+		bottom = (page_number - 1) * paginator.per_page
+		rows = []
+		if page_number >= 1:
+			rows = list(paginator.object_list[bottom:bottom + paginator.per_page])
+		join_count()
+		try:
+			page_number = paginator.validate_number(page_number)
+		except InvalidPage:
+			return paginator.page(1)
+		return paginator.page_of(rows, page_number)
+
+	def can_count_concurrently(self, items):
+		"""
+		The concurrent count runs on another connection that has to see the
+		same data: not possible within a transaction or with an in-memory
+		SQLite database. Grids already running on a worker, for example
+		within a GridBatch, count inline.
+		"""
+		if not self.concurrent_count or not hasattr(items, "db") or _in_worker():
+			return False
+		return _can_use_other_connections(items.db)
+
+	def start_count(self, request, paginator):
+		"""
+		Start counting the objects of paginator on a worker thread and
+		return a function that waits for the count and stores it into the
+		paginator, errors are raised by that function. A count still queued
+		or running after concurrent_timeout seconds is made again inline.
+		Return None when the count can't run concurrently.
+		"""
+		items = paginator.object_list
+		if not self.can_count_concurrently(items):
+			return None
+		result = _run_concurrently(lambda: self.count_items(request, items),
+			items.db, "count", self.concurrent_workers, self.get_metrics().enabled)
+		def join():
+			try:
+				(count, count_mode), duration, queries = result.get(self.concurrent_timeout)
+			except TimeoutError:
+				logger.warning("%s.%s: concurrent count timed out", self.__class__.__module__,
+					self.__class__.__name__)
+				paginator._count, paginator.count_mode = self.count_items(request, items)
+				return
+			paginator._count, paginator.count_mode = count, count_mode
+			self.get_metrics().record("count", duration, queries)
+		return join
+
+	def get_keyset_ordering(self, request):
+		"""
+		Return the list of keys used to seek pages and whether the order is
+		descending. The primary key is always the last key, it's the
+		tiebreaker that makes the ordering total.
+		"""
+		pk_name = self.get_model()._meta.pk.name
+		sidx = request.GET.get("sidx")
+		desc = request.GET.get("sord") == "desc"
+		if sidx and sidx not in ("pk", pk_name):
+			return ([sidx, pk_name], desc)
+		return ([pk_name], desc)
+
+	def get_seek_filter(self, keys, values, lookup, using):
+		"""
+		Return the Q object selecting the rows after values (before them
+		when lookup is lt) in the order of keys, values may be None. NULLs
+		are placed where the database of the using alias sorts them.
+		"""
+		nulls_largest = connections[using].vendor in NULLS_LARGEST_VENDORS
+		# Whether NULLs come after the other values in the seek direction
+		nulls_after = (lookup == "gt") == nulls_largest
+		# (a, b) > (x, y) becomes a > x OR (a = x AND b > y), where a NULL
+		# is greater or lower than any value and only equal to NULL
+		seek = None
+		equal = None
+		for key, value in zip(keys, values):
+			if value is None:
+				# Only values can come after a NULL, when NULLs are first
+				after = None
+				if not nulls_after:
+					after = models.Q(**{"%s__isnull" % key: False})
+				same = models.Q(**{"%s__isnull" % key: True})
+			else:
+				after = models.Q(**{"%s__%s" % (key, lookup): value})
+				if nulls_after:
+					after |= models.Q(**{"%s__isnull" % key: True})
+				same = models.Q(**{key: value})
+			if after is not None:
+				if equal is not None:
+					after = equal & after
+				seek = seek is None and after or seek | after
+			equal = equal is None and same or equal & same
+		if seek is None:
+			return MATCH_NONE
+		return seek
+
+	def iter_keyset(self, request, items, batch_size):
+		"""
+		Iterate over the rows of a values() queryset in the order of
+		get_keyset_ordering(), fetching batch_size rows at a time and
+		seeking past the last row of each batch. Unlike iterator(), which
+		psycopg2 and MySQLdb fill with the whole result set, only a batch
+		is held in memory.
+		"""
+		keys, desc = self.get_keyset_ordering(request)
+		names = list(items._fields)
+		prefix = desc and "-" or ""
+		try:
+			ordered = items.values(*(names + [k for k in keys if k not in names]))
+			ordered = ordered.order_by(*["%s%s" % (prefix, k) for k in keys])
+		except FieldError:
+			keys, desc = keys[-1:], False
+			ordered = items.values(*(names + [k for k in keys if k not in names]))
+			ordered = ordered.order_by(*keys)
+		extra = [k for k in keys if k not in names]
+		lookup = desc and "lt" or "gt"
+		batch = ordered[:batch_size]
+		while True:
+			rows = list(batch)
+			for row in rows:
+				if extra:
+					row = dict([(name, row[name]) for name in names])
+				yield row
+			if len(rows) < batch_size:
+				return
+			last = [rows[-1][k] for k in keys]
+			batch = ordered.filter(self.get_seek_filter(keys, last, lookup, ordered.db))[:batch_size]
+
+	def encode_cursor(self, direction, keys, desc, row):
+		values = []
+		for key in keys:
+			# NULLs are kept, get_seek_filter() knows where they sort
+			value = row.get(key)
+			if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+				value = value.isoformat()
+			elif isinstance(value, Decimal):
+				value = str(value)
+			values.append(value)
+		cursor = json.dumps({"d": direction, "k": keys, "o": desc, "v": values})
+		return base64.urlsafe_b64encode(cursor)
+
+	def decode_cursor(self, request, keys, desc):
+		"""
+		Return a (direction, values) pair from the cursor sent by the client
+		or None when it's missing or doesn't match the current ordering.
+		"""
+		cursor = request.GET.get(self.cursor_param)
+		if not cursor:
+			return None
+		try:
+			cursor = json.loads(base64.urlsafe_b64decode(smart_str(cursor)))
+		except (TypeError, ValueError):
+			return None
+		if not isinstance(cursor, dict) or cursor.get("d") not in ("next", "prev"):
+			return None
+		if cursor.get("k") != keys or cursor.get("o") != desc:
+			return None
+		values = cursor.get("v")
+		if not isinstance(values, list) or len(values) != len(keys):
+			return None
+		return (cursor["d"], values)
+
+	def paginate_keyset(self, request, items):
+		"""
+		Paginate with WHERE (sidx, pk) > (...) instead of LIMIT/OFFSET, the
+		cost of a page doesn't depend on how deep it is.
+		Without a cursor (first page or cursor from another ordering) the
+		page is fetched with OFFSET and cursors for the next requests are
+		computed from its rows.
+		"""
+		paginate_by = self.get_paginate_by(request)
+		if not paginate_by:
+			return (None, None, items)
+
+		keys, desc = self.get_keyset_ordering(request)
+		if hasattr(items, "_fields"):
+			# Make sure the keys are fetched, cursors are built from them
+			names = list(self.get_projected_field_names(request))
+			missing = [k for k in keys if k not in names]
+			if missing:
+				items = items.values(*(names + missing))
+		prefix = desc and "-" or ""
+		try:
+			items = items.order_by(*["%s%s" % (prefix, k) for k in keys])
+		except FieldError:
+			keys, desc = keys[-1:], False
+			items = items.order_by(*keys)
+
+		paginator = self.get_paginator(request, items, paginate_by)
+		try:
+			page_number = max(int(request.GET.get("page", 1)), 1)
+		except ValueError:
+			page_number = 1
+
+		cursor = self.decode_cursor(request, keys, desc)
+		if cursor is None:
+			page = self.get_page(request, paginator, page_number)
+			rows = list(page.object_list)
+			has_next, has_prev = page.has_next(), page.has_previous()
+		else:
+			direction, values = cursor
+			forward = direction == "next"
+			lookup = forward != desc and "gt" or "lt"
+			seek = items.filter(self.get_seek_filter(keys, values, lookup, items.db))
+			if not forward:
+				seek = seek.reverse()
+			join_count = self.start_count(request, paginator)
+			rows = list(seek[:paginate_by + 1])
+			if join_count is not None:
+				join_count()
+			has_more = len(rows) > paginate_by
+			rows = rows[:paginate_by]
+			if not forward:
+				rows.reverse()
+			has_next = not forward or has_more
+			has_prev = forward or has_more
+			page = Page(rows, page_number, paginator)
+
+		page.next_cursor = None
+		page.prev_cursor = None
+		if rows and hasattr(rows[0], "get"):
+			if has_next:
+				page.next_cursor = self.encode_cursor("next", keys, desc, rows[-1])
+			if has_prev:
+				page.prev_cursor = self.encode_cursor("prev", keys, desc, rows[0])
+		return (paginator, page, rows)
+
 	def get_data(self, request, as_json=True):
 		# Honor the start_empty setting
 		_search = request.GET.get("_search", "false")
@@ -248,23 +1523,69 @@ class JqGrid(object):
 			}
 		else:
 			# Otherwise return the items
-			paginator, page, items = self.get_items(request)
-			result = {
-				"page": page.number,
-				"total": paginator.num_pages,
-				"rows": items,
-				"records": paginator.count
-			}
+			self.metrics = GridMetrics(self.instrument)
+			if as_json:
+				result = self.get_cached(request, "json", lambda: self._get_json(request))
+			else:
+				result = self.get_cached(request, "data", lambda: self._get_data(request))
+			self.finish_metrics(request)
+			return result
 		if as_json:
 			return json_encode(result)
 		return result
 
+	def _get_data(self, request):
+		paginator, page, items = self.get_items(request)
+		result = self.get_page_result(request, paginator, page, items)
+		if self.cache_results or self.coalesce:
+			# Querysets can't be cached nor shared
+			result["rows"] = list(result["rows"])
+		return result
+
 	def get_results(self, request):
 		items = self.get_full_queryset(request)
 		items = self.filter_items(request, items)
 		items = self.sort_items(request, items)
 		return items
 
+	def get_export_rows(self, request):
+		"""
+		Iterate over the filtered and sorted rows as tuples, the first one
+		holds the column labels.
+		Rows are read keyset_batch_size at a time with iter_keyset(), so
+		the result set is never held in memory as a whole.
+		"""
+		field_names = list(self.get_field_names())
+		items = self.get_queryset(request)
+		items = self.filter_items(request, items).values(*field_names)
+		yield [force_unicode(colmodel["label"]) for colmodel in self.get_colmodels()]
+		for row in self.iter_keyset(request, items, self.keyset_batch_size):
+			yield tuple([row[name] for name in field_names])
+
+	def export(self, request, format="csv"):
+		"""
+		Return a streaming response with the rows of the grid as CSV or as
+		an Excel spreadsheet, honoring search filters and sorting.
+		"""
+		if format not in self.export_formats:
+			raise Http404("Unknown export format %s" % format)
+		content_type, extension = self.export_formats[format]
+		rows = self.get_export_rows(request)
+		if format == "xls":
+			content = xls_iter(rows, self.get_caption())
+		else:
+			content = self.export_csv(rows)
+		response = StreamingHttpResponse(content, content_type=content_type)
+		response["Content-Disposition"] = attachment_disposition(u"%s.%s" % (
+			force_unicode(self.get_caption()), extension))
+		return response
+
+	def export_csv(self, rows):
+		writer = csv.writer(_Echo())
+		for row in rows:
+			yield writer.writerow([value is not None and smart_str(value) or ""
+				for value in row])
+
 	def get_json(self, request):
 		# Honor the start_empty setting
 		if self.start_empty and request.GET.get("_search", "false") == "false":
@@ -275,20 +1596,253 @@ class JqGrid(object):
 				"records": 0
 			})
 		# Otherwise return the items
+		self.metrics = GridMetrics(self.instrument)
+		content = self.get_cached(request, "json", lambda: self._get_json(request))
+		self.finish_metrics(request)
+		return content
+
+	def _get_json(self, request):
 		paginator, page, items = self.get_items(request)
-		return json_encode({
+		result = self.get_page_result(request, paginator, page, items)
+		with self.get_metrics().phase("encode"):
+			return json_encode(result)
+
+	def get_json_response(self, request):
+		"""
+		Return get_json() as an HttpResponse, with a Server-Timing header
+		when the grid is instrumented.
+		The response carries an ETag and is replaced by 304 Not Modified
+		when the client already has it.
+		"""
+		etag = self.get_etag(request)
+		if etag_matches(request, etag):
+			response = HttpResponseNotModified()
+		else:
+			response = HttpResponse(self.get_json(request), content_type="application/json")
+			if self.metrics is not None and self.metrics.enabled:
+				response["Server-Timing"] = self.metrics.server_timing()
+		response["ETag"] = etag
+		response["Cache-Control"] = "private, no-cache"
+		return response
+
+	def get_etag(self, request, kind="json"):
+		"""
+		Return the entity tag of a response of the grid, made of
+		get_etag_key() and of get_data_version().
+		When etag_timeout is set the tag also changes every etag_timeout
+		seconds, so that clients eventually refetch rows that depend on
+		something else than the models, such as the current date.
+		"""
+		parts = [self.get_etag_key(request, kind), self.get_data_version(request)]
+		if self.etag_timeout:
+			parts.append(int(time.time() // self.etag_timeout))
+		return make_etag(*parts)
+
+	def get_etag_key(self, request, kind):
+		"""
+		Return what identifies the response besides the data version, by
+		default get_cache_key() so that grids overriding it to tell apart
+		users never answer 304 to the page of another user.
+		"""
+		return self.get_cache_key(request, kind)
+
+	def get_data_version(self, request):
+		"""
+		Return a value that changes whenever the rows of the grid may change:
+		the generation of every model involved or, when etag_field is set,
+		its latest value along with the number of records; the latter also
+		notices changes made with QuerySet.update() but costs a query.
+		"""
+		if self.etag_field:
+			version = self.get_full_queryset(request).aggregate(
+				latest=models.Max(self.etag_field), count=models.Count("pk"))
+			return (version["latest"], version["count"])
+		return [get_model_generation(model) for model in self.get_cache_models(request)]
+
+	def get_cached(self, request, kind, func):
+		"""
+		Return the value computed by func, from the cache when cache_results
+		is enabled; kind tells apart different values of the same request.
+		"""
+		if self.coalesce:
+			compute = func
+			func = lambda: self.get_coalesced(request, kind, compute)
+		if not self.cache_results:
+			return func()
+		key = self.get_cache_key(request, kind)
+		value = cache.get(key)
+		if value is None:
+			value = func()
+			cache.set(key, value, self.cache_timeout)
+			_count_cache_access(self.__class__, "misses")
+			self.get_metrics().cache = "miss"
+		else:
+			_count_cache_access(self.__class__, "hits")
+			self.get_metrics().cache = "hit"
+		return value
+
+	def get_coalesced(self, request, kind, func):
+		"""
+		Return func(), shared with the identical requests (same
+		get_cache_key()) running at the same time according to coalesce:
+		  - "process" or True: threads of this process wait for the first one
+		  - "cache": processes wait for the first one through a lock in the
+		    cache, that must be shared among them
+		Waiting lasts at most coalesce_timeout seconds, after that requests
+		compute their own result.
+		"""
+		key = self.get_cache_key(request, kind)
+		if self.coalesce == "cache":
+			return _cache_flight(key, func, self.coalesce_timeout)
+		return _single_flight(key, func, self.coalesce_timeout)
+
+	def get_cache_key(self, request, kind):
+		"""
+		The key is made of the grid class, the normalized request parameters
+		and the generation of every model involved, so saving or deleting any
+		of them invalidates the cached pages.
+		Override this when the queryset depends on something else than the
+		parameters, for example the current user; ETags are derived from it
+		too, see get_etag_key().
+		"""
+		params = self.get_request_params(request)
+		generations = [get_model_generation(model) for model in self.get_cache_models(request)]
+		signature = hashlib.md5(smart_str(u"%r|%r" % (params, generations))).hexdigest()
+		return "django_gems.jqgrid.result.%s.%s.%s.%s" % (self.__class__.__module__,
+			self.__class__.__name__, kind, signature)
+
+	def get_request_params(self, request):
+		"""
+		Return the request parameters as a sorted list of (name, values),
+		without cache_ignored_params and with the filters normalized.
+		"""
+		params = []
+		for name, values in sorted(request.GET.lists()):
+			if name in self.cache_ignored_params:
+				continue
+			if name == "filters":
+				values = [json.dumps(self.get_filters(request), sort_keys=True)]
+			params.append((name, values))
+		return params
+
+	def get_cache_models(self, request):
+		"""
+		Return the grid model and the models reached through the __ paths of
+		the fields and of the search filters, watching all of them.
+		"""
+		field_names = list(self.get_field_names())
+		filters = self.get_filters(request)
+		if filters:
+			field_names.extend([rule["field"] for rule in filters["rules"]])
+		return self.get_related_models(field_names)
+
+	def get_related_models(self, field_names):
+		"""
+		Return the grid model and the models reached through the __ paths of
+		field_names, watching all of them.
+		"""
+		models_list, complete = _get_path_models(self.get_model(), field_names)
+		for related in models_list:
+			watch_model(related)
+		return models_list
+
+	@classmethod
+	def get_cache_stats(cls):
+		"""
+		Return the number of cache hits and misses of this grid class in the
+		current process.
+		"""
+		return dict(_cache_stats.get(cls, {"hits": 0, "misses": 0}))
+
+	def get_json_stream(self, request):
+		"""
+		Same as get_json() but returns an iterator over pieces of the JSON
+		string: the envelope is written first and then the rows are encoded
+		stream_chunk_size at a time. Without pagination (rows=0) the rows
+		are read keyset_batch_size at a time with iter_keyset().
+		Wrap it into a StreamingHttpResponse. When the grid is instrumented
+		the rows fetched and encoded while the iterator is consumed are the
+		stream phase, metrics are reported once it's exhausted or closed.
+		"""
+		if self.start_empty and request.GET.get("_search", "false") == "false":
+			return iter([self.get_json(request)])
+		self.metrics = GridMetrics(self.instrument)
+		paginator, page, items = self.get_items(request)
+		result = self.get_page_result(request, paginator, page, items)
+		if paginator is None and hasattr(items, "_fields"):
+			result["rows"] = self.iter_keyset(request, items, self.keyset_batch_size)
+		if not self.metrics.enabled:
+			return json_iterencode(result, self.stream_chunk_size)
+		if paginator is None:
+			result["rows"] = self._count_rows(result["rows"])
+		return self._stream_metrics(request, json_iterencode(result, self.stream_chunk_size))
+
+	def _count_rows(self, rows):
+		metrics = self.get_metrics()
+		metrics.rows = 0
+		for row in rows:
+			metrics.rows += 1
+			yield row
+
+	def _stream_metrics(self, request, chunks):
+		metrics = self.get_metrics()
+		duration = 0.0
+		try:
+			with QueryCounter() as counter:
+				while True:
+					start = time.time()
+					try:
+						chunk = next(chunks)
+					except StopIteration:
+						break
+					finally:
+						duration += (time.time() - start) * 1000
+					yield chunk
+		finally:
+			metrics.record("stream", duration, counter.count)
+			self.finish_metrics(request)
+
+	def get_page_result(self, request, paginator, page, items):
+		if paginator is None:
+			# Pagination is disabled (rows=0), everything is on one page
+			count, count_mode = self.count_items(request, items)
+			result = {
+				"page": 1,
+				"total": 1,
+				"rows": items,
+				"records": count,
+				"countMode": count_mode
+			}
+			if self.aggregates:
+				result["userData"] = self.get_aggregates(request, items)
+			return result
+		result = {
 			"page": page.number,
 			"total": paginator.num_pages,
 			"rows": items,
-			"records": paginator.count
-		})
+			"records": paginator.count,
+			"countMode": paginator.count_mode
+		}
+		if self.keyset:
+			result["nextCursor"] = getattr(page, "next_cursor", None)
+			result["prevCursor"] = getattr(page, "prev_cursor", None)
+		if self.aggregates:
+			result["userData"] = self.get_aggregates(request, paginator.object_list)
+		return result
 
 	def get_html(self, request, template, context):
-		from django.template.response import TemplateResponse
 		items = self.get_results(request)
 		logger.debug(items)
 		context.update({"caption": self.caption, "items": items})
-		return TemplateResponse(request, template, context)
+		return GridTemplateResponse(self, request, template, context)
+
+	def report_render_queries(self, request, count):
+		"""
+		Called with the number of queries issued to render get_html(),
+		override it to send the number to a monitoring system.
+		"""
+		logger.info("%s.%s rendered with %d queries", self.__class__.__module__,
+			self.__class__.__name__, count)
 
 	def get_default_config(self):
 		config = {
@@ -326,15 +1880,58 @@ class JqGrid(object):
 		return self.caption
 
 	def get_config(self, as_json=True):
+		"""
+		The configuration and its JSON string are built once for every
+		get_config_key(), the dict returned is a copy that can be changed.
+		"""
+		key = self.get_config_key()
+		cached = _configs.get(key)
+		if cached is None:
+			config = self.build_config()
+			if len(_configs) >= self.config_cache_size:
+				_configs.clear()
+			cached = _configs[key] = (config, json_encode(config))
+		if as_json:
+			return cached[1]
+		return copy.deepcopy(cached[0])
+
+	def build_config(self):
 		config = self.get_default_config()
 		config.update({
 			"url": self.get_url(),
 			"caption": self.get_caption(),
 			"colModel": self.get_colmodels(),
 		})
-		if as_json:
-			config = json_encode(config)
+		if self.aggregates:
+			config.update({"footerrow": True, "userDataOnFooter": True})
 		return config
+
+	def get_config_key(self):
+		"""
+		Return what the configuration depends on: the grid class, its model,
+		url, caption, the active language (labels may be lazy translations)
+		and the config_attributes, which may be set on the instance as well.
+		Override it when the configuration depends on something else, for
+		example the current user.
+		"""
+		values = tuple([repr(getattr(self, name)) for name in self.config_attributes])
+		return (self.__class__, self.get_model(), self.get_url(), force_unicode(self.get_caption()),
+			translation.get_language(), values)
+
+	def get_config_response(self, request):
+		"""
+		Return get_config() as an HttpResponse with an ETag made of its
+		content, 304 Not Modified when the client already has it.
+		"""
+		config = self.get_config()
+		etag = make_etag(config)
+		if etag_matches(request, etag):
+			response = HttpResponseNotModified()
+		else:
+			response = HttpResponse(config, content_type="application/json")
+		response["ETag"] = etag
+		response["Cache-Control"] = "private, no-cache"
+		return response
 	
 	def lookup_foreign_key_field(self, options, field_name):
 		"""Make a field lookup converting __ into real models fields"""
@@ -363,6 +1960,32 @@ class JqGrid(object):
 			colmodels.append(colmodel)
 		return colmodels
 
+	def get_projected_field_names(self, request):
+		"""
+		Return the names of the fields fetched by get_queryset().
+		With project_columns only the columns displayed by the client are
+		fetched, together with their joins: the ones listed by the
+		columns_param request parameter (comma separated) or, without it,
+		the ones that colmodel_overrides doesn't hide. The primary key and
+		key columns are always fetched because jqGrid uses them as row ids.
+		Sorting and searching work on any field, fetched or not.
+		"""
+		field_names = self.get_field_names()
+		if not self.project_columns:
+			return field_names
+		requested = request.GET.get(self.columns_param)
+		if requested:
+			visible = set(requested.split(","))
+		else:
+			visible = set([name for name in field_names
+				if not self.colmodel_overrides.get(name, {}).get("hidden")])
+		keys = set(["id", "pk", self.get_model()._meta.pk.name])
+		keys.update([name for name in field_names
+			if self.colmodel_overrides.get(name, {}).get("key")])
+		projected = [name for name in field_names if name in visible or name in keys]
+		# values() without names would fetch every field
+		return projected or field_names
+
 	def get_field_names(self):
 		fields = self.fields
 		if not fields:
@@ -377,3 +2000,102 @@ class JqGrid(object):
 			"editable": False
 		}
 		return colmodel
+
+class GridBatch(object):
+	"""
+	Returns the data of several grids with one request, for pages that
+	show many of them:
+
+		batch = GridBatch({"orders": OrderGrid, "customers": CustomerGrid})
+
+		def grids(request):
+			return batch.get_json_response(request)
+
+	The body of the POST is a JSON list of {"id": grid id, "params": {...}}
+	where params are the query parameters the grid would have received,
+	the response is a list with what get_data() of the grid returns for
+	every entry, in the same order, or {"error": message} for unknown
+	grids. The same grid may appear more than once, with other params.
+	Grids run one after another on the connection of the request; with
+	parallel=True they run on a pool of workers, each with its own
+	connection, unless the request is within a transaction. Grids still
+	queued or running after timeout seconds are answered with an error.
+	"""
+	parallel = False
+	workers = 4
+	timeout = 60
+	max_grids = 20
+
+	def __init__(self, grids, parallel=None):
+		self.grids = grids
+		if parallel is not None:
+			self.parallel = parallel
+
+	def get_json_response(self, request):
+		if request.method != "POST":
+			return HttpResponseNotAllowed(["POST"])
+		try:
+			entries = json_decode(request.body)
+			if not isinstance(entries, list) or len(entries) > self.max_grids:
+				raise ValueError("Expected a list of at most %d grids" % self.max_grids)
+			for entry in entries:
+				if not isinstance(entry, dict) or not isinstance(entry.get("id"), basestring) or \
+						not isinstance(entry.get("params", {}), dict):
+					raise ValueError("Expected {\"id\": \"...\", \"params\": {...}}")
+		except ValueError as e:
+			return HttpResponseBadRequest(str(e))
+		return HttpResponse(json_encode(self.get_data(request, entries)),
+			content_type="application/json")
+
+	def get_data(self, request, entries):
+		"""
+		Return the list of the data of the grid of every entry, in order.
+		"""
+		results = [None] * len(entries)
+		pending = []
+		for i, entry in enumerate(entries):
+			grid_id = entry.get("id")
+			grid_class = self.grids.get(grid_id)
+			if grid_class is None:
+				results[i] = {"error": "Unknown grid %s" % grid_id}
+				continue
+			grid = grid_class()
+			grid_request = self.get_grid_request(request, entry.get("params", {}))
+			using = grid.get_queryset(grid_request).db
+			if self.parallel and _can_use_other_connections(using):
+				task = lambda grid=grid, grid_request=grid_request: \
+					self.get_grid_data(grid, grid_request)
+				pending.append((i, _run_concurrently(task, using, "batch", self.workers)))
+			else:
+				results[i] = self.get_grid_data(grid, grid_request)
+		deadline = time.time() + self.timeout
+		for i, result in pending:
+			try:
+				results[i] = result.get(max(deadline - time.time(), 0))[0]
+			except TimeoutError:
+				results[i] = {"error": "Timed out"}
+		return results
+
+	def get_grid_data(self, grid, request):
+		try:
+			data = grid.get_data(request, as_json=False)
+		except Http404 as e:
+			return {"error": str(e)}
+		# Fetch the rows now, possibly on the worker
+		data["rows"] = list(data["rows"])
+		return data
+
+	def get_grid_request(self, request, params):
+		"""
+		Return a copy of request with params as query parameters.
+		"""
+		grid_request = copy.copy(request)
+		grid_request.method = "GET"
+		grid_request.GET = QueryDict("", mutable=True)
+		for name, value in params.items():
+			if isinstance(value, (list, tuple)):
+				grid_request.GET.setlist(name, [force_unicode(v) for v in value])
+			else:
+				grid_request.GET[name] = force_unicode(value)
+		grid_request.POST = QueryDict("")
+		return grid_request
@@ -36,91 +36,420 @@
 #		http://code.google.com/p/dojango/source/browse/trunk/dojango/util/__init__.py
 #
 
-import os, datetime, json
+from __future__ import absolute_import
+
+import os, datetime, json, types
 from decimal import Decimal
 
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.core.serializers.json import DateTimeAwareJSONEncoder
-from django.db.models import Model
+from django.db.models import Model, SubfieldBase
+from django.db.models.signals import post_init
 from django.db.models import ImageField, FileField
 from django.db.models.query import QuerySet
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified
+try:
+	from django.http import StreamingHttpResponse
+except ImportError:
+	# Before Django 1.5 HttpResponse consumed iterators lazily
+	StreamingHttpResponse = HttpResponse
 from django.utils.functional import Promise
 from django.utils.encoding import force_unicode
+from .utils.http import etag_matches
+
+# Serialization plan of every model class, see _get_model_plan()
+_model_plans = {}
 
-def json_encode(data):
+def _get_model_plan(cls):
 	"""
-	The main issues with Django's default JSON serializer is that properties that
-	had been added to an object dynamically are being ignored (and it also has 
-	problems with some models).
+	Return the (attname, converter) pairs of the fields of a model class
+	and the set of names that are not properties added to its instances.
 	"""
-	def _any(data):
-		ret = None
-		# Ops, we used to check if it is of type list, but that fails 
-		# i.e. in the case of django.newforms.utils.ErrorList, which extends
-		# the type "list". Oh man, that was a dumb mistake!
-		if isinstance(data, list):
-			ret = _list(data)
-		# Same as for lists above.
-		elif isinstance(data, dict):
-			ret = _dict(data)
-		elif isinstance(data, Decimal):
-			# json.dumps() cant handle Decimal
-			ret = str(data)
-		elif isinstance(data, QuerySet):
-			# Actually its the same as a list ...
-			ret = _list(data)
-		elif isinstance(data, Model):
-			ret = _model(data)
-		# here we need to encode the string as unicode (otherwise we get utf-16 in the json-response)
-		elif isinstance(data, basestring):
-			ret = unicode(data)
-		# see http://code.djangoproject.com/ticket/5868
-		elif isinstance(data, Promise):
-			ret = force_unicode(data)
-		elif isinstance(data, datetime.datetime):
-			# For dojo.date.stamp we convert the dates to use 'T' as separator instead of space
-			# i.e. 2008-01-01T10:10:10 instead of 2008-01-01 10:10:10
-			ret = str(data).replace(' ', 'T')
-		elif isinstance(data, datetime.date):
-			ret = str(data)
-		elif isinstance(data, datetime.time):
-			ret = 'T' + str(data)
-		else:
-			# Always fallback to a string!
-			ret = data
-		return ret
-	
-	def _model(data):
-		ret = {}
-		# If we only have a model, we only want to encode the fields.
-		for f in data._meta.fields:
+	plan = _model_plans.get(cls)
+	if plan is None:
+		fields = []
+		for f in cls._meta.fields:
 			# special FileField handling (they can't be json serialized)
 			if isinstance(f, ImageField) or isinstance(f, FileField):
-				ret[f.attname] = unicode(getattr(data, f.attname))
+				fields.append((f.attname, unicode))
 			else:
-				ret[f.attname] = _any(getattr(data, f.attname))
-		# And additionally encode arbitrary properties that had been added.
-		fields = dir(data.__class__) + ret.keys()
+				fields.append((f.attname, None))
 		# ignoring _state and delete properties
-		add_ons = [k for k in dir(data) if k not in fields and k not in ('delete', '_state',)]
-		for k in add_ons:
-			ret[k] = _any(getattr(data, k))
-		return ret
-
-	def _list(data):
-		ret = []
-		for v in data:
-			ret.append(_any(v))
-		return ret
-	
-	def _dict(data):
-		ret = {}
-		for k,v in data.items():
-			ret[k] = _any(v)
-		return ret
-	
-	ret = _any(data)
-	return json.dumps(ret, cls=DateTimeAwareJSONEncoder)
+		known = set(dir(cls))
+		known.update([attname for attname, converter in fields])
+		known.update(("delete", "_state"))
+		plan = _model_plans[cls] = (fields, known)
+	return plan
+
+def _encode_model(data):
+	fields, known = _get_model_plan(data.__class__)
+	ret = {}
+	# If we only have a model, we only want to encode the fields.
+	for attname, converter in fields:
+		value = getattr(data, attname)
+		if converter is not None:
+			value = converter(value)
+		ret[attname] = value
+	# And additionally encode arbitrary properties that had been added.
+	for k, v in data.__dict__.items():
+		if k not in known:
+			ret[k] = v
+	return ret
+
+# Rows fetched at a time by querysets read with iterator()
+QUERYSET_CHUNK_SIZE = 2000
+
+_queryset_iterator = getattr(QuerySet.iterator, "__func__", QuerySet.iterator)
+
+def _get_projection(data):
+	"""
+	Return the (attname, is file) pairs of the fields of the model of data
+	when its instances would be encoded just as their field values, that is
+	when data yields instances with nothing but their fields, None otherwise.
+	"""
+	# values(), values_list() and dates() override iterator()
+	iterator = type(data).iterator
+	if getattr(iterator, "__func__", iterator) is not _queryset_iterator:
+		return None
+	query = data.query
+	if query.select_related or query.extra_select or query.aggregates or \
+			query.deferred_loading[0] or data._prefetch_related_lookups:
+		return None
+	model = data.model
+	# Instances could get more than their fields
+	if model.__init__ != Model.__init__ or post_init.has_listeners(model):
+		return None
+	fields, known = _get_model_plan(model)
+	# concrete_fields is new in Django 1.6, before it fields were all concrete
+	concrete = getattr(model._meta, "concrete_fields", model._meta.fields)
+	if len(concrete) != len(fields):
+		return None
+	for f in concrete:
+		# Fields converting values when they are assigned to the instance
+		if isinstance(type(f), SubfieldBase):
+			return None
+	return [(attname, converter is not None) for attname, converter in fields]
+
+def _iterator(data, chunk_size):
+	try:
+		return data.iterator(chunk_size=chunk_size)
+	except TypeError:
+		# Django < 2.0 fetches GET_ITERATOR_CHUNK_SIZE rows at a time
+		return data.iterator()
+
+def _iter_queryset(data, chunk_size=QUERYSET_CHUNK_SIZE):
+	"""
+	Iterate over the rows of a queryset without filling its result cache;
+	model instances are not even built when their fields are all there is
+	to encode, their values are read with values_list().
+	"""
+	if data._result_cache is not None:
+		return iter(data._result_cache)
+	fields = _get_projection(data)
+	if fields is None:
+		return _iterator(data, chunk_size)
+	rows = data.values_list(*[attname for attname, is_file in fields])
+	return _iter_values(fields, _iterator(rows, chunk_size))
+
+def _iter_values(fields, rows):
+	names = [attname for attname, is_file in fields]
+	files = [i for i, (attname, is_file) in enumerate(fields) if is_file]
+	for row in rows:
+		if files:
+			row = list(row)
+			for i in files:
+				# What unicode() of the FieldFile would give
+				row[i] = force_unicode(row[i] or u"")
+		yield dict(zip(names, row))
+
+def _encode_datetime(data):
+	# For dojo.date.stamp we convert the dates to use 'T' as separator instead of space
+	# i.e. 2008-01-01T10:10:10 instead of 2008-01-01 10:10:10
+	return str(data).replace(' ', 'T')
+
+# Functions converting the types json.dumps() can't handle, see register_encoder()
+_encoders = {
+	# json.dumps() cant handle Decimal
+	Decimal: str,
+	# see http://code.djangoproject.com/ticket/5868
+	Promise: force_unicode,
+	datetime.datetime: _encode_datetime,
+	datetime.date: str,
+	datetime.time: lambda data: 'T' + str(data),
+	# Actually its the same as a list ...
+	QuerySet: lambda data: list(_iter_queryset(data)),
+	Model: _encode_model,
+}
+# Encoder of every type met so far, subclasses included
+_resolved_encoders = {}
+
+def register_encoder(cls, func):
+	"""
+	Make json_encode() encode instances of cls, and of its subclasses, as
+	what func returns for them.
+	"""
+	_encoders[cls] = func
+	_resolved_encoders.clear()
+
+def _get_encoder(cls):
+	try:
+		return _resolved_encoders[cls]
+	except KeyError:
+		pass
+	func = None
+	for base in cls.__mro__:
+		if base in _encoders:
+			func = _encoders[base]
+			break
+	_resolved_encoders[cls] = func
+	return func
+
+class GemsJSONEncoder(DateTimeAwareJSONEncoder):
+	"""
+	Converts the values json can't handle while serializing, dispatching
+	on their type, so that data is walked only once.
+	"""
+	def default(self, o):
+		func = _get_encoder(type(o))
+		if func is None:
+			return super(GemsJSONEncoder, self).default(o)
+		return func(o)
+
+def _json_backend():
+	def dumps(data, default=None):
+		return json.dumps(data, cls=GemsJSONEncoder, default=default)
+	return dumps, json.loads
+
+def _simplejson_backend():
+	import simplejson
+	gems_default = GemsJSONEncoder().default
+	def dumps(data, default=None):
+		# Leave Decimal and namedtuple to default() like json does
+		return simplejson.dumps(data, default=default or gems_default,
+			use_decimal=False, namedtuple_as_object=False, tuple_as_array=True)
+	return dumps, simplejson.loads
+
+def _ujson_backend():
+	import ujson
+	# ujson can't call back for Decimal, dates and models: decoding only
+	return None, ujson.loads
+
+# Factories returning the (dumps, loads) functions of a backend, None when
+# it can't do one of them; ImportError when the backend isn't installed.
+# dumps(data, default=None) calls default, when given, instead of
+# GemsJSONEncoder.default()
+JSON_BACKEND_FACTORIES = {
+	"json": _json_backend,
+	"simplejson": _simplejson_backend,
+	"ujson": _ujson_backend,
+}
+
+# Default for the JSON_BACKENDS setting, json is always the last resort.
+# The others are opt-in: simplejson decodes ASCII strings to str instead of
+# unicode and is slower than json at calling default()
+DEFAULT_JSON_BACKENDS = ("json",)
+
+_backend = None
+
+def get_json_backend():
+	"""
+	Return the (names, dumps, loads) backend used by json_encode() and
+	json_decode(), names being the encoder and decoder names: the first
+	backends of the JSON_BACKENDS setting, in order of preference, that are
+	installed and able to encode or decode.
+	The backend is built again whenever the setting changes.
+	"""
+	global _backend
+	names = getattr(settings, "JSON_BACKENDS", DEFAULT_JSON_BACKENDS)
+	if isinstance(names, basestring):
+		names = (names,)
+	names = tuple(names)
+	if _backend is None or _backend[0] != names:
+		encoder = decoder = None
+		for name in names + ("json",):
+			if name not in JSON_BACKEND_FACTORIES:
+				raise ImproperlyConfigured("Unknown JSON backend %s" % name)
+			try:
+				dumps, loads = JSON_BACKEND_FACTORIES[name]()
+			except ImportError:
+				continue
+			if encoder is None and dumps is not None:
+				encoder = (name, dumps)
+			if decoder is None and loads is not None:
+				decoder = (name, loads)
+			if encoder is not None and decoder is not None:
+				break
+		_backend = (names, ((encoder[0], decoder[0]), encoder[1], decoder[1]))
+	return _backend[1]
+
+class _Nested(object):
+	"""
+	A model instance or a queryset found depth levels of model instances
+	below the data given to json_encode().
+	"""
+	__slots__ = ("value", "depth")
+
+	def __init__(self, value, depth):
+		self.value = value
+		self.depth = depth
+
+class _GraphEncoder(object):
+	"""
+	The default() function of json_encode() with refs or max_depth: it
+	follows the depth of model instances and, with refs, encodes each of
+	them once into the refs dictionary and replaces it with a reference.
+	"""
+	def __init__(self, refs, max_depth):
+		self.refs = refs
+		self.max_depth = max_depth
+		self.default = GemsJSONEncoder().default
+		# id() of the instances met -> (instance, reference key)
+		self.keys = {}
+		self.keys_by_pk = {}
+		self.pending = []
+		# (id() of the instance, depth) -> (instance, encoded fields)
+		self.fields = {}
+
+	def __call__(self, o):
+		depth = 0
+		if type(o) is _Nested:
+			o, depth = o.value, o.depth
+		if isinstance(o, Model):
+			return self.encode_model(o, depth)
+		if isinstance(o, QuerySet):
+			# Instances are needed for their references
+			rows = o._result_cache
+			if rows is None:
+				rows = _iterator(o, QUERYSET_CHUNK_SIZE)
+			return [_Nested(row, depth) for row in rows]
+		if isinstance(o, (dict, list, tuple)):
+			# Rows of a queryset read with values() or values_list()
+			return o
+		return self.default(o)
+
+	def encode_model(self, o, depth):
+		if self.max_depth is not None and depth > self.max_depth:
+			return o.pk
+		if self.refs:
+			return {"$ref": self.get_key(o, depth)}
+		return self.get_fields(o, depth)
+
+	def get_key(self, o, depth):
+		entry = self.keys.get(id(o))
+		if entry is not None:
+			return entry[1]
+		opts = o._meta
+		label = "%s.%s" % (opts.app_label, opts.object_name.lower())
+		if o.pk is None:
+			key = "%s#%d" % (label, len(self.keys))
+		else:
+			key = "%s:%s" % (label, o.pk)
+		if key not in self.keys_by_pk:
+			# Other instances of the same row are encoded only once
+			self.keys_by_pk[key] = o
+			self.pending.append((key, o, depth))
+		self.keys[id(o)] = (o, key)
+		return key
+
+	def get_fields(self, o, depth):
+		entry = self.fields.get((id(o), depth))
+		if entry is None:
+			fields = _encode_model(o)
+			known = _get_model_plan(o.__class__)[1]
+			for name, value in fields.items():
+				# Only the properties added to o can hold instances
+				if name not in known:
+					fields[name] = self.nest(value, depth + 1)
+			entry = self.fields[(id(o), depth)] = (o, fields)
+		return entry[1]
+
+	def nest(self, value, depth):
+		if isinstance(value, (Model, QuerySet)):
+			return _Nested(value, depth)
+		if isinstance(value, (list, tuple)):
+			return [self.nest(v, depth) for v in value]
+		if isinstance(value, dict):
+			return dict([(k, self.nest(v, depth)) for k, v in value.items()])
+		return value
+
+	def encode(self, data, dumps):
+		encoded = dumps(data, self)
+		if not self.refs:
+			return encoded
+		refs = []
+		done = 0
+		while done < len(self.pending):
+			# Encoding some instances can find more of them
+			batch = self.pending[done:]
+			done = len(self.pending)
+			encoded_refs = dumps(dict([(key, self.get_fields(o, depth))
+				for key, o, depth in batch]), self)
+			refs.append(encoded_refs[1:-1])
+		return '{"data": %s, "refs": {%s}}' % (encoded, ", ".join(refs))
+
+def json_encode(data, refs=False, max_depth=None):
+	"""
+	The main issues with Django's default JSON serializer is that properties that
+	had been added to an object dynamically are being ignored (and it also has 
+	problems with some models).
+	A queryset is encoded a chunk of rows at a time.
+	With refs=True model instances are encoded once, and replaced with a
+	{"$ref": "app_label.model:pk"} object: the result is
+	{"data": data, "refs": {reference: fields of the instance}}.
+	With max_depth the instances found through more than max_depth other
+	instances, for example in the attributes added to them, are replaced
+	with their primary key; that also stops reference cycles.
+	"""
+	if refs or max_depth is not None:
+		return _GraphEncoder(refs, max_depth).encode(data, get_json_backend()[1])
+	if isinstance(data, QuerySet):
+		return "".join(json_iterencode(data, QUERYSET_CHUNK_SIZE))
+	return get_json_backend()[1](data)
+
+def _is_streamable(data):
+	return isinstance(data, (list, tuple, QuerySet, types.GeneratorType))
+
+def json_iterencode(data, chunk_size=100):
+	"""
+	Same output as json_encode() but yields the JSON string in pieces.
+	Lists, querysets and generators are encoded chunk_size items at a time,
+	querysets are read with iterator(), and values_list() when possible, so
+	that neither their model instances nor the encoded payload are ever
+	held in memory as a whole. The rows themselves may be: psycopg2 and
+	MySQLdb fetch the whole result set, see JqGrid.iter_keyset().
+	Dictionaries yield their scalar values first, for example the page,
+	total and records of a jqGrid response come before the rows.
+	"""
+	if isinstance(data, dict):
+		items = sorted(data.items(), key=lambda item: _is_streamable(item[1]))
+		yield "{"
+		for i, (key, value) in enumerate(items):
+			if not isinstance(key, basestring):
+				key = unicode(key)
+			yield "%s%s: " % (i and ", " or "", json_encode(key))
+			for chunk in json_iterencode(value, chunk_size):
+				yield chunk
+		yield "}"
+	elif _is_streamable(data):
+		if isinstance(data, QuerySet):
+			data = _iter_queryset(data)
+		dumps = get_json_backend()[1]
+		yield "["
+		separator = ""
+		buffer = []
+		for value in data:
+			buffer.append(value)
+			if len(buffer) >= chunk_size:
+				# The chunk encoded as a list, without brackets
+				yield separator + dumps(buffer)[1:-1]
+				separator = ", "
+				buffer = []
+		if buffer:
+			yield separator + dumps(buffer)[1:-1]
+		yield "]"
+	else:
+		yield json_encode(data)
 
 def json_decode(json_string):
 	"""
@@ -128,44 +457,72 @@ def json_decode(json_string):
 	Sometimes you want to convert a json-string to a python object.
 	It throws a ValueError, if the JSON String is invalid.
 	"""
-	return json.loads(json_string)
+	return get_json_backend()[2](json_string)
 
-def json_view(func):
+def json_view(func=None, stream=False, chunk_size=100, etag=None):
 	"""
 	Decorator that serializes data into a JSON string.
+	With stream=True the response is a StreamingHttpResponse that encodes
+	data with json_iterencode(), use it as @json_view(stream=True).
+	etag is a function called with the view arguments that returns a
+	quoted entity tag: when the If-None-Match header matches it the view
+	is not called and the response is 304 Not Modified.
 	"""
-	def _wrap(request, *args, **kwargs):
-		response = None
-		try:
-			data = func(request, *args, **kwargs)
-		except KeyboardInterrupt:
-			# Allow keyboard interrupts through for debugging.
-			raise
-		import datetime
-		encoded = json_encode(data)
-		response = HttpResponse(encoded, mimetype="application/json")
-		response["Pragma"] = "no-cache"
-		response["Cache-Control"] = "must-revalidate"
-		response["If-Modified-Since"] = str(datetime.datetime.now())
-		return response
-	return _wrap
+	def _decorator(func):
+		def _wrap(request, *args, **kwargs):
+			response = None
+			tag = None
+			if etag is not None:
+				tag = etag(request, *args, **kwargs)
+				if etag_matches(request, tag):
+					response = HttpResponseNotModified()
+					response["ETag"] = tag
+					return response
+			try:
+				data = func(request, *args, **kwargs)
+			except KeyboardInterrupt:
+				# Allow keyboard interrupts through for debugging.
+				raise
+			if stream:
+				response = StreamingHttpResponse(json_iterencode(data, chunk_size),
+					content_type="application/json")
+			else:
+				encoded = json_encode(data)
+				response = HttpResponse(encoded, mimetype="application/json")
+			response["Pragma"] = "no-cache"
+			response["Cache-Control"] = "no-cache"
+			if tag is not None:
+				response["ETag"] = tag
+			return response
+		return _wrap
+	if func is not None:
+		return _decorator(func)
+	return _decorator
 
 class JSONResponseMixin(object):
+	json_stream = False
+	json_chunk_size = 100
+
 	def render_to_response(self, context):
 		"Returns a JSON response containing 'context' as payload."
 		return self.get_json_response(self.convert_context_to_json(context))
 	
 	def get_json_response(self, content, **httpresponse_kwargs):
 		"Construct a `HttpResponse` object."
-		import datetime
-		response = HttpResponse(content,
-				mimetype="application/json",
-				**httpresponse_kwargs)
+		if self.json_stream:
+			response = StreamingHttpResponse(content,
+					content_type="application/json",
+					**httpresponse_kwargs)
+		else:
+			response = HttpResponse(content,
+					mimetype="application/json",
+					**httpresponse_kwargs)
 		response["Pragma"] = "no-cache"
-		response["Cache-Control"] = "must-revalidate"
-		response["If-Modified-Since"] = str(datetime.datetime.now())
+		response["Cache-Control"] = "no-cache"
 		return response
 	
 	def convert_context_to_json(self, context):
 		"Convert the context dictionary into a JSON object."
+		if self.json_stream:
+			return json_iterencode(context, self.json_chunk_size)
 		return json_encode(context)
@@ -0,0 +1,287 @@
+#
+# Django Gems.
+#
+# Copyright (C) 2016 Pier Luigi Fiorini
+#
+# Author: Pier Luigi Fiorini <pierluigi.fiorini@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#	1. Redistributions of source code must retain the above copyright notice,
+#	   this list of conditions and the following disclaimer.
+#
+#	2. Redistributions in binary form must reproduce the above copyright
+#	   notice, this list of conditions and the following disclaimer in the
+#	   documentation and/or other materials provided with the distribution.
+#
+#	3. Neither the name of the project nor the names of its contributors may
+#	   be used to endorse or promote products derived from this software
+#	   without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+"""
+Search backends that turn jqGrid text searches (cn, icn...) into index
+lookups instead of LIKE '%...%' scans, or add full text searches (fts).
+
+A backend is bound to a model and to its searchable fields, install()
+creates and fills the index, then apply() restricts a queryset to the rows
+matching a search:
+
+	class ItemGrid(JqGrid):
+		model = Item
+		search_fields = ["name", "description"]
+		search_backend = FTS5SearchBackend
+
+	ItemGrid().get_search_backend().install()
+"""
+
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save, post_delete
+from django.utils.encoding import force_unicode
+
+try:
+	from django.db.transaction import atomic
+except ImportError:
+	from django.db.transaction import commit_on_success as atomic
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+class SearchBackend(object):
+	"""
+	Base class of search backends.
+	"""
+	# jqGrid operators handled by the backend
+	operators = ()
+	# Name of the extra select holding the relevance of each row, lower
+	# is better; None when the backend doesn't rank
+	rank_name = None
+
+	def __init__(self, model, fields, using=DEFAULT_DB_ALIAS):
+		self.model = model
+		self.fields = list(fields)
+		self.using = using
+
+	@property
+	def connection(self):
+		return connections[self.using]
+
+	def quote_name(self, name):
+		return self.connection.ops.quote_name(name)
+
+	@property
+	def table(self):
+		return self.model._meta.db_table
+
+	def column(self, field_name):
+		return self.model._meta.get_field(field_name).column
+
+	def supports(self, field_name, op):
+		return field_name in self.fields and op in self.operators
+
+	def install(self):
+		"""
+		Create the index and fill it with the rows of the model.
+		"""
+		raise NotImplementedError
+
+	def apply(self, items, field_name, op, data, rank=False):
+		"""
+		Return items restricted to the rows that match data, ordered by
+		relevance when rank is True. Return None when the search can't be
+		answered by the index, the caller falls back to a normal lookup.
+		"""
+		raise NotImplementedError
+
+class FTS5SearchBackend(SearchBackend):
+	"""
+	SQLite FTS5 full text search over an external content table, kept in
+	sync by triggers. Words of the search are matched as prefixes, the
+	ranking is the bm25 score computed by SQLite.
+	That isn't what cn and icn mean (a word prefix is not any substring),
+	so the backend only answers the fts operator, leaving the others to
+	their lookups.
+	"""
+	operators = ("fts",)
+	rank_name = "search_rank"
+
+	@property
+	def fts_table(self):
+		return "%s_fts" % self.table
+
+	def install(self):
+		if self.connection.vendor != "sqlite":
+			raise ImproperlyConfigured("FTS5 is only available on SQLite")
+		qn = self.quote_name
+		fts, table = qn(self.fts_table), qn(self.table)
+		pk = qn(self.model._meta.pk.column)
+		columns = [qn(self.column(f)) for f in self.fields]
+		new_values = ", ".join(["new.%s" % c for c in columns])
+		old_values = ", ".join(["old.%s" % c for c in columns])
+		statements = [
+			"CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, content=%s, content_rowid=%s)" % (
+				fts, ", ".join(columns), table, pk),
+			"CREATE TRIGGER IF NOT EXISTS %s AFTER INSERT ON %s BEGIN "
+				"INSERT INTO %s (rowid, %s) VALUES (new.%s, %s); END" % (
+				qn(self.fts_table + "_ai"), table, fts, ", ".join(columns), pk, new_values),
+			"CREATE TRIGGER IF NOT EXISTS %s AFTER DELETE ON %s BEGIN "
+				"INSERT INTO %s (%s, rowid, %s) VALUES ('delete', old.%s, %s); END" % (
+				qn(self.fts_table + "_ad"), table, fts, fts, ", ".join(columns), pk, old_values),
+			"CREATE TRIGGER IF NOT EXISTS %s AFTER UPDATE ON %s BEGIN "
+				"INSERT INTO %s (%s, rowid, %s) VALUES ('delete', old.%s, %s); "
+				"INSERT INTO %s (rowid, %s) VALUES (new.%s, %s); END" % (
+				qn(self.fts_table + "_au"), table, fts, fts, ", ".join(columns), pk, old_values,
+				fts, ", ".join(columns), pk, new_values),
+			"INSERT INTO %s (%s) VALUES ('rebuild')" % (fts, fts),
+		]
+		cursor = self.connection.cursor()
+		with atomic(using=self.using):
+			for statement in statements:
+				cursor.execute(statement)
+
+	def get_match(self, field_name, op, data):
+		words = WORD_RE.findall(force_unicode(data))
+		if not words:
+			return None
+		terms = ['"%s"*' % word for word in words]
+		return u"%s : (%s)" % (self.column(field_name), " ".join(terms))
+
+	def apply(self, items, field_name, op, data, rank=False):
+		match = self.get_match(field_name, op, data)
+		if match is None:
+			return None
+		qn = self.quote_name
+		fts = qn(self.fts_table)
+		pk = "%s.%s" % (qn(self.table), qn(self.model._meta.pk.column))
+		items = items.extra(
+			where=["%s IN (SELECT rowid FROM %s WHERE %s MATCH %%s)" % (pk, fts, fts)],
+			params=[match])
+		if rank:
+			items = items.extra(
+				select={self.rank_name: "SELECT rank FROM %s WHERE %s MATCH %%s AND rowid = %s" % (
+					fts, fts, pk)},
+				select_params=[match],
+				order_by=[self.rank_name])
+		return items
+
+class TrigramSearchBackend(SearchBackend):
+	"""
+	Inverted index of the trigrams of the searchable fields stored in a
+	table of the database, works on every backend. Rows containing all the
+	trigrams of the search are candidates, the ones really containing it
+	are then picked with a normal lookup. Searches shorter than three
+	characters can't use the index.
+	The index is kept up to date by post_save and post_delete signals,
+	connected as soon as the backend is created: JqGrid creates the
+	backends of its subclasses when they are defined.
+	"""
+	operators = ("cn", "icn")
+
+	def __init__(self, model, fields, using=DEFAULT_DB_ALIAS):
+		SearchBackend.__init__(self, model, fields, using)
+		self.installed = False
+		uid = "django_gems.search.trigram.%s" % self.table
+		post_save.connect(self._saved, sender=model, weak=False, dispatch_uid=uid)
+		post_delete.connect(self._deleted, sender=model, weak=False, dispatch_uid=uid)
+
+	def is_installed(self):
+		"""
+		Tell if the index table exists, until then saves are not indexed:
+		install() reads every row anyway.
+		"""
+		if not self.installed:
+			self.installed = self.index_table in self.connection.introspection.table_names()
+		return self.installed
+
+	@property
+	def index_table(self):
+		return "%s_trigram" % self.table
+
+	def trigrams(self, value):
+		value = force_unicode(value or "").lower()
+		return set([value[i:i + 3] for i in range(len(value) - 2)])
+
+	def install(self):
+		qn = self.quote_name
+		index = qn(self.index_table)
+		cursor = self.connection.cursor()
+		with atomic(using=self.using):
+			cursor.execute("CREATE TABLE %s (field VARCHAR(100) NOT NULL, "
+				"gram VARCHAR(3) NOT NULL, object_id INTEGER NOT NULL)" % index)
+			cursor.execute("CREATE INDEX %s ON %s (field, gram)" % (
+				qn(self.index_table + "_gram"), index))
+			cursor.execute("CREATE INDEX %s ON %s (object_id)" % (
+				qn(self.index_table + "_object"), index))
+		rows = self.model._default_manager.using(self.using).values_list(
+			"pk", *self.fields).iterator()
+		batch = []
+		for row in rows:
+			batch.extend(self._entries(row[0], row[1:]))
+			if len(batch) >= 10000:
+				self._insert(batch)
+				batch = []
+		self._insert(batch)
+		self.installed = True
+
+	def _entries(self, pk, values):
+		entries = []
+		for field_name, value in zip(self.fields, values):
+			entries.extend([(field_name, gram, pk) for gram in self.trigrams(value)])
+		return entries
+
+	def _insert(self, entries):
+		if not entries:
+			return
+		cursor = self.connection.cursor()
+		with atomic(using=self.using):
+			cursor.executemany("INSERT INTO %s (field, gram, object_id) VALUES (%%s, %%s, %%s)" %
+				self.quote_name(self.index_table), entries)
+
+	def _delete(self, pk):
+		cursor = self.connection.cursor()
+		cursor.execute("DELETE FROM %s WHERE object_id = %%s" %
+			self.quote_name(self.index_table), [pk])
+
+	def _saved(self, sender, instance, **kwargs):
+		if not self.is_installed():
+			return
+		with atomic(using=self.using):
+			self._delete(instance.pk)
+			self._insert(self._entries(instance.pk,
+				[getattr(instance, field_name) for field_name in self.fields]))
+
+	def _deleted(self, sender, instance, **kwargs):
+		if not self.is_installed():
+			return
+		self._delete(instance.pk)
+
+	def apply(self, items, field_name, op, data, rank=False):
+		grams = sorted(self.trigrams(data))
+		if not grams:
+			return None
+		qn = self.quote_name
+		pk = "%s.%s" % (qn(self.table), qn(self.model._meta.pk.column))
+		items = items.extra(
+			where=["%s IN (SELECT object_id FROM %s WHERE field = %%s AND gram IN (%s) "
+				"GROUP BY object_id HAVING COUNT(DISTINCT gram) = %d)" % (
+				pk, qn(self.index_table), ", ".join(["%s"] * len(grams)), len(grams))],
+			params=[field_name] + grams)
+		# Trigrams only select candidates
+		lookup = op == "cn" and "contains" or "icontains"
+		return items.filter(**{"%s__%s" % (field_name, lookup): force_unicode(data)})
@@ -0,0 +1,316 @@
+#
+# Django Gems.
+#
+# Copyright (C) 2016 Pier Luigi Fiorini
+#
+# Author: Pier Luigi Fiorini <pierluigi.fiorini@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#	1. Redistributions of source code must retain the above copyright notice,
+#	   this list of conditions and the following disclaimer.
+#
+#	2. Redistributions in binary form must reproduce the above copyright
+#	   notice, this list of conditions and the following disclaimer in the
+#	   documentation and/or other materials provided with the distribution.
+#
+#	3. Neither the name of the project nor the names of its contributors may
+#	   be used to endorse or promote products derived from this software
+#	   without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+"""
+In-memory columnar snapshots of grids, see JqGrid.snapshot.
+
+The fields of a grid are loaded into NumPy arrays, one per column, and
+searches, sorting and pagination run as vectorized operations without
+touching the database. Rows are rebuilt from the columns with the values
+the database returned.
+"""
+
+import datetime, time
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.utils.encoding import force_unicode
+from django.utils.timezone import utc
+
+INTEGER_TYPES = ("AutoField", "IntegerField", "BigIntegerField", "SmallIntegerField",
+	"PositiveIntegerField", "PositiveSmallIntegerField", "ForeignKey", "OneToOneField")
+BOOLEAN_TYPES = ("BooleanField", "NullBooleanField")
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def _datetime_key(value):
+	if value.tzinfo is not None:
+		value = value.replace(tzinfo=None) - value.utcoffset()
+	delta = value - EPOCH
+	return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def _time_key(value):
+	return ((value.hour * 60 + value.minute) * 60 + value.second) * 1000000 + value.microsecond
+
+def _time_value(key):
+	seconds, microsecond = divmod(key, 1000000)
+	minutes, second = divmod(seconds, 60)
+	hour, minute = divmod(minutes, 60)
+	return datetime.time(hour, minute, second, microsecond)
+
+def _key_function(internal_type):
+	"""
+	Return the function that converts a value of a field into the scalar
+	stored in its column, the NumPy type of the column and the function
+	that converts a scalar back into the value (None when the scalar is
+	the value). The NumPy type is None for the fields that are dictionary
+	encoded instead.
+	"""
+	if internal_type in INTEGER_TYPES:
+		return (int, "int64", None)
+	if internal_type == "FloatField":
+		return (float, "float64", None)
+	if internal_type in BOOLEAN_TYPES:
+		return (bool, "bool", None)
+	if internal_type == "DateTimeField":
+		return (_datetime_key, "int64",
+			lambda key: EPOCH + datetime.timedelta(microseconds=key))
+	if internal_type == "DateField":
+		return (lambda value: value.toordinal(), "int64", datetime.date.fromordinal)
+	if internal_type == "TimeField":
+		return (_time_key, "int64", _time_value)
+	return (None, None, None)
+
+def _text_array(numpy, values):
+	values = [force_unicode(value) for value in values]
+	return numpy.array(values, dtype="U") if values else numpy.array([], dtype="U1")
+
+class Column(object):
+	"""
+	Values of a field. Numbers, dates and times are stored as scalars that
+	compare like them, the other values (text, decimals...) are dictionary
+	encoded: distinct holds the sorted distinct values and keys the index
+	of the value of each row into it.
+	"""
+	def __init__(self, numpy, values, internal_type):
+		self.numpy = numpy
+		self.key, dtype, self.decode = _key_function(internal_type)
+		self.null = numpy.array([value is None for value in values], dtype="bool")
+		if dtype is None:
+			present = numpy.empty(len(values) - int(self.null.sum()), dtype=object)
+			present[:] = [value for value in values if value is not None]
+			self.distinct, codes = numpy.unique(present, return_inverse=True)
+			# NULL rows point to the first distinct value, null tells them apart
+			self.keys = numpy.zeros(len(values), dtype="int32")
+			self.keys[~self.null] = codes
+		else:
+			self.distinct = None
+			keys = [self.key(value) if value is not None else 0 for value in values]
+			self.keys = numpy.array(keys, dtype=dtype)
+			if internal_type == "DateTimeField" and any(
+					value is not None and value.tzinfo is not None for value in values):
+				# Aware datetimes are stored in UTC
+				decode = self.decode
+				self.decode = lambda key: decode(key).replace(tzinfo=utc)
+
+	def text(self, value):
+		return force_unicode(value)
+
+	def values(self, indexes):
+		"""
+		Return the list of the values of the rows at indexes.
+		"""
+		keys = self.keys[indexes]
+		null = self.null[indexes].tolist()
+		if self.distinct is not None:
+			values = self.distinct[keys].tolist() if len(self.distinct) else [None] * len(keys)
+		elif self.decode is not None:
+			values = [None if is_null else self.decode(key)
+				for key, is_null in zip(keys.tolist(), null)]
+		else:
+			values = keys.tolist()
+		return [None if is_null else value for value, is_null in zip(values, null)]
+
+	def match(self, lookup, value):
+		"""
+		Return the mask of the rows matching a Django lookup, NULLs never
+		match like in SQL. Dictionary encoded columns are matched on their
+		distinct values only.
+		"""
+		if self.distinct is None:
+			mask = self._match(self.keys, lookup, value)
+		else:
+			mask = self._match(self.distinct, lookup, value)
+			if mask is not None:
+				mask = mask[self.keys] if len(mask) else self.numpy.zeros(len(self.keys), dtype=bool)
+		if mask is None:
+			return None
+		return mask & ~self.null
+
+	def _match(self, keys, lookup, value):
+		np = self.numpy
+		key = self.key or (lambda value: value)
+		if lookup == "in":
+			return np.in1d(keys, [key(v) for v in value])
+		if lookup in ("startswith", "endswith", "contains", "iexact", "icontains"):
+			value = self.text(value)
+			keys = keys.astype("U") if self.distinct is None else _text_array(np, keys)
+			if lookup == "startswith":
+				return np.char.startswith(keys, value)
+			if lookup == "endswith":
+				return np.char.endswith(keys, value)
+			if lookup == "contains":
+				return np.char.find(keys, value) >= 0
+			lower = np.char.lower(keys)
+			if lookup == "iexact":
+				return lower == value.lower()
+			return np.char.find(lower, value.lower()) >= 0
+		value = key(value)
+		if lookup == "exact":
+			return keys == value
+		if lookup == "gt":
+			return keys > value
+		if lookup == "gte":
+			return keys >= value
+		if lookup == "lt":
+			return keys < value
+		if lookup == "lte":
+			return keys <= value
+		return None
+
+class GridSnapshot(object):
+	"""
+	Snapshot of the rows of a grid, generations are the generations of
+	the models it was loaded from.
+	"""
+	def __init__(self, grid, request, generations):
+		import numpy
+		self.numpy = numpy
+		self.generations = generations
+		self.loaded_at = time.time()
+		self.field_names = list(grid.get_field_names())
+		items = grid.get_queryset(request).values_list(*self.field_names)
+		values = [[] for name in self.field_names]
+		for row in items.iterator():
+			for column, value in zip(values, row):
+				column.append(value)
+		# The loaded values are dropped once encoded, rows are rebuilt from
+		# the columns
+		self.columns = {}
+		for name, column in zip(self.field_names, values):
+			internal_type = grid.get_field_info(name)[1]
+			self.columns[name] = Column(numpy, column, internal_type)
+		self.size = len(values[0]) if values else 0
+
+	def is_fresh(self, timeout, generations):
+		return self.generations == generations and time.time() - self.loaded_at < timeout
+
+	def filter(self, grid, filters):
+		"""
+		Return the indexes of the rows matching filters, or None when they
+		can't be evaluated on the snapshot.
+		"""
+		np = self.numpy
+		if filters is None:
+			return np.arange(self.size)
+		masks = []
+		for rule in filters["rules"]:
+			column = self.columns.get(rule["field"])
+			if column is None or rule["op"] not in grid.filter_map:
+				return None
+			filter_fmt, exclude = grid.filter_map[rule["op"]]
+			lookup = filter_fmt.rsplit("__", 1)[-1]
+			coerce = grid.get_field_info(rule["field"])[2]
+			data = rule["data"]
+			try:
+				if lookup == "in":
+					value = grid.coerce_values(coerce, data.split(","))
+					if not value:
+						raise ValidationError("No valid value in %r" % data)
+				elif lookup in ("startswith", "endswith", "contains", "iexact", "icontains"):
+					value = data
+				else:
+					value = coerce(data)
+			except ValidationError:
+				# False for every row, true when negated, like the database
+				masks.append(np.empty(self.size, dtype=bool))
+				masks[-1].fill(bool(exclude))
+				continue
+			if value is None and lookup == "exact":
+				# exact None is isnull, like the ORM does
+				mask = column.null.copy()
+			else:
+				mask = column.match(lookup, value)
+			if mask is None:
+				return None
+			if exclude:
+				# exclude() keeps NULLs
+				mask = ~mask
+			masks.append(mask)
+		if not masks:
+			return np.arange(self.size)
+		if filters["groupOp"].upper() == "OR":
+			mask = np.logical_or.reduce(masks)
+		else:
+			mask = np.logical_and.reduce(masks)
+		return np.flatnonzero(mask)
+
+	def sort(self, indexes, sidx, desc):
+		"""
+		Return indexes sorted by the sidx column, NULLs first like SQLite,
+		or None when sidx isn't a column of the snapshot.
+		"""
+		column = self.columns.get(sidx)
+		if column is None:
+			return None
+		np = self.numpy
+		order = np.lexsort((column.keys[indexes], ~column.null[indexes]))
+		if desc:
+			order = order[::-1]
+		return indexes[order]
+
+	def rows(self, indexes, field_names):
+		return SnapshotRows(self, indexes, field_names)
+
+class SnapshotRows(object):
+	"""
+	Lazy sequence of the rows of a snapshot, rows are built as dicts like
+	the ones of a values() queryset only when sliced.
+	"""
+	def __init__(self, snapshot, indexes, field_names):
+		self.snapshot = snapshot
+		self.indexes = indexes
+		self.field_names = field_names
+
+	def __len__(self):
+		return len(self.indexes)
+
+	def count(self):
+		return len(self.indexes)
+
+	def __iter__(self):
+		return iter(self[:])
+
+	def __getitem__(self, key):
+		columns = self.snapshot.columns
+		if isinstance(key, slice):
+			indexes = self.indexes[key]
+		else:
+			indexes = self.indexes[key:key + 1]
+		values = [columns[name].values(indexes) for name in self.field_names]
+		rows = [dict(zip(self.field_names, row)) for row in zip(*values)]
+		if isinstance(key, slice):
+			return rows
+		return rows[0]
@@ -0,0 +1,70 @@
+#
+# Django Gems.
+#
+# Copyright (C) 2016 Pier Luigi Fiorini
+#
+# Author: Pier Luigi Fiorini <pierluigi.fiorini@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#	1. Redistributions of source code must retain the above copyright notice,
+#	   this list of conditions and the following disclaimer.
+#
+#	2. Redistributions in binary form must reproduce the above copyright
+#	   notice, this list of conditions and the following disclaimer in the
+#	   documentation and/or other materials provided with the distribution.
+#
+#	3. Neither the name of the project nor the names of its contributors may
+#	   be used to endorse or promote products derived from this software
+#	   without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+class QueryCounter(object):
+	"""
+	Counts the queries executed on a database connection, even when DEBUG
+	is off:
+
+		with QueryCounter() as counter:
+			...
+		print counter.count
+	"""
+	def __init__(self, using=DEFAULT_DB_ALIAS):
+		self.using = using
+		self.connection = None
+		self.start = self.end = 0
+
+	def __enter__(self):
+		self.connection = connections[self.using]
+		self.saved_debug_cursor = self.connection.use_debug_cursor
+		# The debug cursor records queries into connection.queries
+		self.connection.use_debug_cursor = True
+		self.start = len(self.connection.queries)
+		self.end = None
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.end = len(self.connection.queries)
+		self.connection.use_debug_cursor = self.saved_debug_cursor
+		return False
+
+	@property
+	def count(self):
+		if self.end is None:
+			return len(self.connection.queries) - self.start
+		return self.end - self.start
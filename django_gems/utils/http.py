@@ -0,0 +1,72 @@
+#
+# Django Gems.
+#
+# Copyright (C) 2016 Pier Luigi Fiorini
+#
+# Author: Pier Luigi Fiorini <pierluigi.fiorini@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#	1. Redistributions of source code must retain the above copyright notice,
+#	   this list of conditions and the following disclaimer.
+#
+#	2. Redistributions in binary form must reproduce the above copyright
+#	   notice, this list of conditions and the following disclaimer in the
+#	   documentation and/or other materials provided with the distribution.
+#
+#	3. Neither the name of the project nor the names of its contributors may
+#	   be used to endorse or promote products derived from this software
+#	   without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import unicodedata
+import urllib
+from django.utils.encoding import force_unicode, smart_str
+
+def make_etag(*parts):
+	"""
+	Return a strong entity tag, quoted, made of the repr() of parts.
+	"""
+	return '"%s"' % hashlib.md5(smart_str(repr(parts))).hexdigest()
+
+def etag_matches(request, etag):
+	"""
+	Tell whether the If-None-Match header of request matches etag, which
+	must be quoted. Weak tags, added by proxies that compress the body,
+	are compared as strong ones.
+	"""
+	header = request.META.get("HTTP_IF_NONE_MATCH")
+	if not header:
+		return False
+	for candidate in header.split(","):
+		candidate = candidate.strip()
+		if candidate.startswith("W/"):
+			candidate = candidate[2:]
+		if candidate in ("*", etag):
+			return True
+	return False
+
+def attachment_disposition(filename):
+	"""
+	Return a Content-Disposition header value for an attachment named
+	filename: a quoted ASCII fallback for old browsers and the exact name
+	encoded as in RFC 5987.
+	"""
+	filename = force_unicode(filename)
+	fallback = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore")
+	fallback = "".join([c in '\\"' and "_" or c for c in fallback if " " <= c < "\x7f"])
+	return "attachment; filename=\"%s\"; filename*=UTF-8''%s" % (
+		fallback, urllib.quote(filename.encode("utf-8"), safe=""))
@@ -36,7 +36,9 @@ try:
 	from cStringIO import StringIO
 except ImportError:
 	from StringIO import StringIO
+from xml.sax.saxutils import escape
 from django.http import HttpResponse
+from django.utils.encoding import smart_str
 
 def xls_convert(array):
 	"""
@@ -92,3 +94,49 @@ def xls_view(func):
 		response.write(data)
 		return response
 	return _wrap
+
+XLS_XML_HEADER = """<?xml version="1.0" encoding="utf-8"?>
+<?mso-application progid="Excel.Sheet"?>
+<Workbook xmlns="urn:schemas-microsoft-com:office:spreadsheet" xmlns:ss="urn:schemas-microsoft-com:office:spreadsheet">
+<Styles>
+<Style ss:ID="datetime"><NumberFormat ss:Format="D/M/YYYY hh:mm:ss"/></Style>
+<Style ss:ID="date"><NumberFormat ss:Format="D/M/YYYY"/></Style>
+</Styles>
+<Worksheet ss:Name="%s">
+<Table>
+"""
+
+XLS_XML_FOOTER = """</Table>
+</Worksheet>
+</Workbook>
+"""
+
+def _xls_xml_cell(value):
+	import datetime
+	from decimal import Decimal
+
+	if value is None:
+		return "<Cell/>"
+	if isinstance(value, bool):
+		return '<Cell><Data ss:Type="Boolean">%d</Data></Cell>' % value
+	if isinstance(value, (int, long, float, Decimal)):
+		return '<Cell><Data ss:Type="Number">%s</Data></Cell>' % value
+	if isinstance(value, datetime.datetime):
+		return '<Cell ss:StyleID="datetime"><Data ss:Type="DateTime">%s</Data></Cell>' % \
+			value.strftime("%Y-%m-%dT%H:%M:%S")
+	if isinstance(value, datetime.date):
+		return '<Cell ss:StyleID="date"><Data ss:Type="DateTime">%s</Data></Cell>' % \
+			value.strftime("%Y-%m-%dT00:00:00")
+	return '<Cell><Data ss:Type="String">%s</Data></Cell>' % escape(smart_str(value))
+
+def xls_iter(array, sheet_name="Foglio"):
+	"""
+	Like xls_convert() but yields an XML Spreadsheet (the format of Excel
+	2003, which also opens it as .xls) one row at a time.
+	A binary workbook has to be built in memory before it's saved, this
+	works with any iterable of rows, for example a queryset iterator().
+	"""
+	yield XLS_XML_HEADER % escape(smart_str(sheet_name))
+	for row in array:
+		yield "<Row>%s</Row>\n" % "".join([_xls_xml_cell(value) for value in row])
+	yield XLS_XML_FOOTER
@@ -21,7 +21,7 @@ setup(name="django-gems",
 	maintainer_email="pierluigi.fiorini@gmail.com",
 	url="http://plfiorini.github.com/django-gems",
 	download_url="http://github.com/plfiorini/django-gems/tarball/master",
-	packages=find_packages(),
+	packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
 	license="BSD",
 	classifiers=["Development Status :: 5 - Production/Stable",
 		"Intended Audience :: Developers",